@@ -0,0 +1,308 @@
+"""
+Incremental circle-spoofing detection over a sliding time window.
+
+A CircleWindow holds one vessel's positions from the last window seconds in
+arrival order, with running sums of the moments the Kasa circle fit needs
+(up to third order, in coordinates centred on a reference point so the sums
+keep their precision). Adding or expiring a point updates the sums in O(1),
+and the fit is the closed-form solution of the 3x3 normal equations:
+
+    [4Suu 4Suv 2Su] [a]   [2(Suuu + Suvv)]
+    [4Suv 4Svv 2Sv] [b] = [2(Suuv + Svvv)]      r = sqrt(a^2 + b^2 + d)
+    [2Su  2Sv   n ] [d]   [  Suu + Svv   ]
+
+SOG mean and variance are kept the same way (Welford). The point count, SOG
+spread and fitted radius are therefore O(1) checks. The RMS residual and the
+spread of angular steps depend on every point's position relative to the
+new centre, so they are evaluated (vectorized) only for windows that pass
+the O(1) checks, which ordinary traffic rarely does; the decision is the
+same as fitting every window from scratch (circle_fit.fit_circle). Points on
+a straight line (to rounding) have no circle fit and never alert; solving
+their degenerate system would only fit rounding noise. Sums are recomputed
+from the points once per window of updates, so rounding errors cannot build
+up.
+
+    python ais_circle.py
+
+replays synthetic tracks through both and compares decisions and cost.
+"""
+import math
+import time
+from collections import deque
+
+import numpy as np
+
+CIRCLE_DETECTION_WINDOW = 60 * 45  # seconds (45 min window)
+CIRCLE_MIN_POINTS = 3  # LOWERED for testing
+CIRCLE_MAX_RESIDUAL = 0.0001  # degrees, ~10m
+CIRCLE_MIN_RADIUS = 0.1 / 60  # degrees (~0.1 nm)
+CIRCLE_MAX_RADIUS = 2.0 / 60  # degrees (~2 nm)
+CIRCLE_UNIFORMITY_THRESHOLD = 0.03  # radians
+CIRCLE_SOG_STD_THRESHOLD = 0.5  # knots
+
+RESYNC_MIN_UPDATES = 64
+# Points whose covariance has det / trace^2 below this lie on a line (to rounding); they have no circle fit
+COLLINEAR_RATIO = 1e-12
+
+
+def _is_point(lat, lon):
+    # Same filter as the detector always used: a position, and not the 0/0 placeholder
+    return lat is not None and lon is not None and lat == lat and lon == lon and lat != 0 and lon != 0
+
+
+def _angular_steps(angles):
+    """np.diff(np.unwrap(angles)) without building the unwrapped array: steps wrapped into [-pi, pi]."""
+    steps = np.diff(angles)
+    wrap = np.abs(steps) >= np.pi
+    if wrap.any():
+        wrapped = np.mod(steps[wrap] + np.pi, 2 * np.pi) - np.pi
+        wrapped[(wrapped == -np.pi) & (steps[wrap] > 0)] = np.pi
+        steps[wrap] = wrapped
+    return steps
+
+
+class CircleWindow:
+    __slots__ = ("_times", "_lats", "_lons", "_sogs", "_x0", "_y0", "_su", "_sv", "_suu", "_suv", "_svv", "_suuu", "_suuv", "_suvv", "_svvv",
+                 "_n_sog", "_sog_mean", "_sog_m2", "_updates", "stale")
+
+    def __init__(self):
+        # Points oldest first, one deque per column so the candidate check can read lat/lon with np.fromiter
+        self._times = deque()  # epoch seconds
+        self._lats = deque()
+        self._lons = deque()
+        self._sogs = deque()  # knots or None
+        self._x0 = self._y0 = 0.0
+        self._reset_sums()
+        self._updates = 0
+        self.stale = False  # a late point arrived; the owner should rebuild the window
+
+    def __len__(self):
+        return len(self._times)
+
+    @property
+    def oldest(self):
+        return self._times[0] if self._times else None
+
+    @property
+    def newest(self):
+        """(time, lat, lon) of the newest point, or None."""
+        return (self._times[-1], self._lats[-1], self._lons[-1]) if self._times else None
+
+    def load(self, times, lats, lons, sogs):
+        """Fill an empty window from time-sorted columns (e.g. track rows); rows without a position are skipped."""
+        for t, lat, lon, sog in zip(np.asarray(times).tolist(), np.asarray(lats).tolist(),
+                                    np.asarray(lons).tolist(), np.asarray(sogs).tolist()):
+            if _is_point(lat, lon):
+                self._append(t, lat, lon, sog if sog == sog else None)
+        self._resync()
+
+    def add(self, t, lat, lon, sog=None):
+        """Append a report; reports without a position are ignored, one older than the newest marks the window stale."""
+        if not _is_point(lat, lon):
+            return
+        if self._times and t < self._times[-1]:
+            self.stale = True
+            return
+        sog = sog if sog is not None and sog == sog else None
+        if not self._times:
+            self._x0, self._y0 = lat, lon
+        self._append(t, lat, lon, sog)
+        self._accumulate(lat, lon, sog, 1.0)
+        self._count_update()
+
+    def expire(self, cutoff):
+        """Drop points older than `cutoff` (epoch seconds)."""
+        times = self._times
+        while times and times[0] < cutoff:
+            times.popleft()
+            self._accumulate(self._lats.popleft(), self._lons.popleft(), self._sogs.popleft(), -1.0)
+            self._count_update()
+
+    def fit(self):
+        """(center lat, center lon, radius) in degrees from the running sums, or None if degenerate."""
+        n = len(self._times)
+        if n < 3:
+            return None
+        su, sv, suu, suv, svv = self._su, self._sv, self._suu, self._suv, self._svv
+        cuu, cuv, cvv = suu - su * su / n, suv - su * sv / n, svv - sv * sv / n
+        spread = cuu + cvv
+        if spread <= 0 or cuu * cvv - cuv * cuv <= COLLINEAR_RATIO * spread * spread:
+            return None
+        m11, m12, m13 = 4 * suu, 4 * suv, 2 * su
+        m22, m23, m33 = 4 * svv, 2 * sv, float(n)
+        r1 = 2 * (self._suuu + self._suvv)
+        r2 = 2 * (self._suuv + self._svvv)
+        r3 = suu + svv
+        # Cramer's rule on the symmetric system
+        c11 = m22 * m33 - m23 * m23
+        c12 = m13 * m23 - m12 * m33
+        c13 = m12 * m23 - m13 * m22
+        det = m11 * c11 + m12 * c12 + m13 * c13
+        if det == 0:
+            return None
+        a = (r1 * c11 + r2 * c12 + r3 * c13) / det
+        b = (m11 * (r2 * m33 - m23 * r3) - r1 * (m12 * m33 - m13 * m23) + m13 * (m12 * r3 - r2 * m13)) / det
+        d = (m11 * (m22 * r3 - r2 * m23) - m12 * (m12 * r3 - r2 * m13) + r1 * (m12 * m23 - m22 * m13)) / det
+        r2_ = a * a + b * b + d
+        if not r2_ >= 0:
+            return None
+        return self._x0 + a, self._y0 + b, math.sqrt(r2_)
+
+    def detect(self, min_points=CIRCLE_MIN_POINTS, min_radius=CIRCLE_MIN_RADIUS, max_radius=CIRCLE_MAX_RADIUS,
+               max_residual=CIRCLE_MAX_RESIDUAL, max_angle_std=CIRCLE_UNIFORMITY_THRESHOLD,
+               max_sog_std=CIRCLE_SOG_STD_THRESHOLD):
+        """Radius in degrees if the window's points form a suspiciously perfect circle, else None."""
+        n = len(self._times)
+        if n < min_points or self._n_sog < min_points:
+            return None
+        if math.sqrt(max(self._sog_m2, 0.0) / self._n_sog) > max_sog_std:
+            return None
+        fit = self.fit()
+        if fit is None or not min_radius <= fit[2] <= max_radius:
+            return None
+        # Candidate circle: check residual and angular spacing against the points
+        xc, yc, r = fit
+        u = np.fromiter(self._lats, float, n) - self._x0
+        v = np.fromiter(self._lons, float, n) - self._y0
+        a, b = xc - self._x0, yc - self._y0
+        if np.sqrt(np.mean((np.hypot(u - a, v - b) - r) ** 2)) > max_residual:
+            return None
+        if _angular_steps(np.arctan2(b - v, a - u)).std() > max_angle_std:
+            return None
+        return r
+
+    def _append(self, t, lat, lon, sog):
+        self._times.append(t)
+        self._lats.append(lat)
+        self._lons.append(lon)
+        self._sogs.append(sog)
+
+    def _reset_sums(self):
+        self._su = self._sv = self._suu = self._suv = self._svv = 0.0
+        self._suuu = self._suuv = self._suvv = self._svvv = 0.0
+        self._n_sog = 0
+        self._sog_mean = self._sog_m2 = 0.0
+
+    def _accumulate(self, lat, lon, sog, sign):
+        u, v = lat - self._x0, lon - self._y0
+        uu, vv = u * u, v * v
+        self._su += sign * u
+        self._sv += sign * v
+        self._suu += sign * uu
+        self._suv += sign * u * v
+        self._svv += sign * vv
+        self._suuu += sign * uu * u
+        self._suuv += sign * uu * v
+        self._suvv += sign * u * vv
+        self._svvv += sign * vv * v
+        if sog is None:
+            return
+        if sign > 0:
+            self._n_sog += 1
+            delta = sog - self._sog_mean
+            self._sog_mean += delta / self._n_sog
+            self._sog_m2 += delta * (sog - self._sog_mean)
+        else:
+            self._n_sog -= 1
+            if self._n_sog:
+                delta = sog - self._sog_mean
+                self._sog_mean -= delta / self._n_sog
+                self._sog_m2 -= delta * (sog - self._sog_mean)
+            else:
+                self._sog_mean = self._sog_m2 = 0.0
+
+    def _count_update(self):
+        self._updates += 1
+        if self._updates >= max(len(self._times), RESYNC_MIN_UPDATES):
+            self._resync()
+
+    def _resync(self):
+        """Recompute the sums from the points, centred on the newest one."""
+        self._updates = 0
+        self._reset_sums()
+        if not self._times:
+            return
+        self._x0, self._y0 = self._lats[-1], self._lons[-1]
+        for lat, lon, sog in zip(self._lats, self._lons, self._sogs):
+            self._accumulate(lat, lon, sog, 1.0)
+
+
+def _detect_reference(times, lats, lons, sogs, now):
+    """The per-report detector this replaces: select the window and fit it from scratch."""
+    from circle_fit import fit_circle
+
+    lo = int(np.searchsorted(times, now - CIRCLE_DETECTION_WINDOW, "left"))
+    lats, lons, sogs = lats[lo:], lons[lo:], sogs[lo:]
+    selected = np.flatnonzero((lats != 0) & (lons != 0) & ~np.isnan(lats) & ~np.isnan(lons))
+    if len(selected) < CIRCLE_MIN_POINTS:
+        return None
+    xs = lats[selected].tolist()
+    ys = lons[selected].tolist()
+    xc, yc, r, residual = fit_circle(xs, ys)
+    if not (CIRCLE_MIN_RADIUS <= r <= CIRCLE_MAX_RADIUS):
+        return None
+    if residual > CIRCLE_MAX_RESIDUAL:
+        return None
+    thetas = np.unwrap([np.arctan2(yc - y, xc - x) for x, y in zip(xs, ys)])
+    if np.std(np.diff(thetas)) > CIRCLE_UNIFORMITY_THRESHOLD:
+        return None
+    sogs = sogs[selected]
+    sogs = sogs[~np.isnan(sogs)]
+    if len(sogs) < CIRCLE_MIN_POINTS or np.std(sogs) > CIRCLE_SOG_STD_THRESHOLD:
+        return None
+    return r
+
+
+def _synthetic_tracks(rng, reports):
+    """{name: (times, lats, lons, sogs)} for a few kinds of vessel, one report every 10 s."""
+    t = 1.7e9 + np.arange(reports) * 10.0
+    k = np.arange(reports)
+    tracks = {}
+    # Spoofed: a perfect 0.5 nm circle at constant speed, one lap per ~100 reports
+    angle = k * 2 * np.pi / 100
+    tracks["perfect circle"] = (t, 37.8 + 0.5 / 60 * np.cos(angle), -122.4 + 0.5 / 60 * np.sin(angle),
+                                np.full(reports, 9.4))
+    # A real vessel circling (e.g. fishing): same circle with GPS noise and varying speed
+    tracks["noisy circle"] = (t, tracks["perfect circle"][1] + rng.normal(0, 2e-4, reports),
+                              tracks["perfect circle"][2] + rng.normal(0, 2e-4, reports),
+                              9.4 + rng.normal(0, 0.8, reports))
+    # Transit: straight line with small noise, occasional missing SOG
+    sogs = 12 + rng.normal(0, 0.2, reports)
+    sogs[rng.random(reports) < 0.05] = np.nan
+    tracks["transit"] = (t, 37.0 + k * 5e-4 + rng.normal(0, 1e-5, reports),
+                         -123.0 + k * 3e-4 + rng.normal(0, 1e-5, reports), sogs)
+    # Moored: GPS jitter around a point
+    tracks["moored"] = (t, 37.5 + rng.normal(0, 3e-5, reports), -122.3 + rng.normal(0, 3e-5, reports),
+                        np.abs(rng.normal(0, 0.1, reports)))
+    return tracks
+
+
+def _benchmark(reports=3000):
+    rng = np.random.default_rng(7)
+    print(f"{reports} reports per vessel, {CIRCLE_DETECTION_WINDOW // 60} min window")
+    for name, (times, lats, lons, sogs) in _synthetic_tracks(rng, reports).items():
+        # Reference: before each report, fit the window of the earlier reports from scratch
+        start = time.perf_counter()
+        expected = [_detect_reference(times[:i], lats[:i], lons[:i], sogs[:i], times[i]) for i in range(reports)]
+        reference_us = (time.perf_counter() - start) / reports * 1e6
+
+        window = CircleWindow()
+        got = []
+        start = time.perf_counter()
+        for t, lat, lon, sog in zip(times.tolist(), lats.tolist(), lons.tolist(), sogs.tolist()):
+            window.expire(t - CIRCLE_DETECTION_WINDOW)
+            got.append(window.detect())
+            window.add(t, lat, lon, sog)
+        incremental_us = (time.perf_counter() - start) / reports * 1e6
+
+        alerts = sum(r is not None for r in expected)
+        same = sum((a is None) == (b is None) for a, b in zip(expected, got))
+        radius_diff = max([abs(a - b) for a, b in zip(expected, got) if a is not None and b is not None], default=0.0)
+        print(f"  {name:<15} reference {reference_us:7.1f} us  incremental {incremental_us:6.1f} us  "
+              f"alerts {alerts:>5}  same decision {same}/{reports}  max radius difference {radius_diff * 1852 * 60:.1e} m")
+
+
+if __name__ == "__main__":
+    import sys
+
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 3000)
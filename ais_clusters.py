@@ -0,0 +1,216 @@
+"""
+Multi-resolution aggregates of the latest vessel positions for zoomed-out maps.
+
+Each zoom level z has square cells of 360 / 2**(z + CELLS_PER_TILE_LOG2)
+degrees (a few cells per web map tile), so a cell at level z is exactly four
+cells at level z + 1 and a vessel's cell at every level is its finest cell
+index shifted right. Each occupied cell keeps a count, coordinate sums for
+the centroid and counts per ship type category. The sums are integers (in
+1e-7 degrees), so adjusting them by each move is exact: a long-lived cell's
+centroid does not drift however many updates it has seen.
+
+update() works from the finest level down and stops re-bucketing at the first
+level whose cell did not change; coarser levels only get their sums adjusted.
+A vessel that stays within its finest cell costs one sum update per level.
+"""
+import math
+from collections import Counter
+
+import numpy as np
+
+CELLS_PER_TILE_LOG2 = 2  # 4 x 4 cells per 256 px tile
+COORD_SCALE = 10_000_000  # centroid sums in integer 1e-7 degrees
+
+
+def _fixed(degrees):
+    return round(degrees * COORD_SCALE)
+
+
+def cell_size(zoom):
+    return 360.0 / 2 ** (zoom + CELLS_PER_TILE_LOG2)
+
+
+def ship_type_category(ship_type):
+    """AIS ship type code reduced to the category shown for a cluster (e.g. 71 -> 70 cargo), or None."""
+    try:
+        ship_type = int(ship_type)
+    except (TypeError, ValueError):
+        return None
+    if not 20 <= ship_type <= 99:
+        return None
+    # 30-39 and 50-59 are distinct types (fishing, sailing, tug, pilot, ...); the other decades are one category
+    return ship_type if ship_type // 10 in (3, 5) else ship_type // 10 * 10
+
+
+class ClusterIndex:
+    def __init__(self, min_zoom=2, max_zoom=12):
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self._fine = cell_size(max_zoom)
+        self._levels = {z: {} for z in range(min_zoom, max_zoom + 1)}  # {zoom: {cell: [count, sum lat, sum lon (fixed), Counter]}}
+        self._vessels = {}  # {mmsi: [lat, lon, ship type category, finest cell]}
+        self.version = 0  # bumped on every change, for pushing only when something moved
+        self.stats = {"updates": 0, "rebuckets": 0}
+
+    def __len__(self):
+        return len(self._vessels)
+
+    def _fine_cell(self, lat, lon):
+        return (math.floor(lat / self._fine), math.floor(lon / self._fine))
+
+    def _cell(self, fine, zoom):
+        shift = self.max_zoom - zoom
+        return (fine[0] >> shift, fine[1] >> shift)
+
+    def update(self, mmsi, lat, lon, ship_type=None):
+        """Record a vessel's latest position; `ship_type` None keeps the known type."""
+        self.stats["updates"] += 1
+        self.version += 1
+        fine = self._fine_cell(lat, lon)
+        vessel = self._vessels.get(mmsi)
+        category = ship_type_category(ship_type)
+        lat_q, lon_q = _fixed(lat), _fixed(lon)
+        if vessel is None:
+            self._vessels[mmsi] = [lat, lon, category, fine]
+            for zoom, cells in self._levels.items():
+                self._add(cells, self._cell(fine, zoom), lat_q, lon_q, category)
+            return
+        old_lat, old_lon, old_category, old_fine = vessel
+        old_lat_q, old_lon_q = _fixed(old_lat), _fixed(old_lon)
+        if category is None:
+            category = old_category
+        moved = fine != old_fine
+        for zoom in range(self.max_zoom, self.min_zoom - 1, -1):
+            cells = self._levels[zoom]
+            if moved:
+                old_cell, cell = self._cell(old_fine, zoom), self._cell(fine, zoom)
+                moved = old_cell != cell
+            if moved:
+                self._remove(cells, old_cell, old_lat_q, old_lon_q, old_category)
+                self._add(cells, cell, lat_q, lon_q, category)
+                self.stats["rebuckets"] += 1
+                continue
+            aggregate = cells[self._cell(fine, zoom)]
+            aggregate[1] += lat_q - old_lat_q
+            aggregate[2] += lon_q - old_lon_q
+            if category != old_category:
+                aggregate[3][old_category] -= 1
+                aggregate[3][category] += 1
+        vessel[:] = [lat, lon, category, fine]
+
+    def load(self, items):
+        """Insert [(mmsi, lat, lon, ship_type)]; vectorized per level when the index is empty (warm start)."""
+        if self._vessels or not items:
+            for item in items:
+                self.update(*item)
+            return
+        mmsis, lats, lons, ship_types = zip(*items)
+        categories = [ship_type_category(t) for t in ship_types]
+        lats, lons = np.array(lats, dtype=float), np.array(lons, dtype=float)
+        fine_lat = np.floor(lats / self._fine).astype(np.int64)
+        fine_lon = np.floor(lons / self._fine).astype(np.int64)
+        # np.round rounds half to even like round(), so these match _fixed()
+        lats_q = np.round(lats * COORD_SCALE).astype(np.int64)
+        lons_q = np.round(lons * COORD_SCALE).astype(np.int64)
+        for mmsi, lat, lon, category, a, b in zip(mmsis, lats.tolist(), lons.tolist(), categories,
+                                                 fine_lat.tolist(), fine_lon.tolist()):
+            self._vessels[mmsi] = [lat, lon, category, (a, b)]
+        codes = np.array([-1 if c is None else c for c in categories], dtype=np.int64) + 1  # 0 for unknown
+        for zoom, cells in self._levels.items():
+            shift = self.max_zoom - zoom
+            # (lat cell, lon cell) packed into one int64 so grouping is a 1-D unique
+            keys = ((fine_lat >> shift) + 2 ** 30) * 2 ** 32 + ((fine_lon >> shift) + 2 ** 31)
+            keys, inverse = np.unique(keys, return_inverse=True)
+            inverse = inverse.ravel()
+            counts = np.bincount(inverse)
+            sum_lat, sum_lon = np.zeros(len(keys), dtype=np.int64), np.zeros(len(keys), dtype=np.int64)
+            np.add.at(sum_lat, inverse, lats_q)
+            np.add.at(sum_lon, inverse, lons_q)
+            types = [Counter() for _ in range(len(keys))]
+            pairs, pair_counts = np.unique(inverse * 128 + codes, return_counts=True)
+            for pair, n in zip(pairs.tolist(), pair_counts.tolist()):
+                types[pair >> 7][(pair & 127) - 1 if pair & 127 else None] = n
+            for key, n, slat, slon, counter in zip(keys.tolist(), counts.tolist(), sum_lat.tolist(), sum_lon.tolist(), types):
+                cells[((key >> 32) - 2 ** 30, (key & 0xFFFFFFFF) - 2 ** 31)] = [n, slat, slon, counter]
+        self.stats["updates"] += len(items)
+        self.version += 1
+
+    def set_ship_type(self, mmsi, ship_type):
+        vessel = self._vessels.get(mmsi)
+        if vessel is not None and ship_type_category(ship_type) != vessel[2]:
+            self.update(mmsi, vessel[0], vessel[1], ship_type)
+
+    def remove(self, mmsi):
+        vessel = self._vessels.pop(mmsi, None)
+        if vessel is None:
+            return
+        self.version += 1
+        lat, lon, category, fine = vessel
+        for zoom, cells in self._levels.items():
+            self._remove(cells, self._cell(fine, zoom), _fixed(lat), _fixed(lon), category)
+
+    def clear(self):
+        for cells in self._levels.values():
+            cells.clear()
+        self._vessels.clear()
+        self.version += 1
+
+    def zoom_level(self, zoom):
+        return min(max(int(zoom), self.min_zoom), self.max_zoom)
+
+    def query(self, zoom, min_lat=-90.0, max_lat=90.0, min_lon=-180.0, max_lon=180.0):
+        """Cluster dicts for the cells at `zoom` (clamped to the indexed levels) overlapping the box."""
+        zoom = self.zoom_level(zoom)
+        size = cell_size(zoom)
+        cells = self._levels[zoom]
+        lat_lo, lat_hi = math.floor(min_lat / size), math.floor(max_lat / size)
+        lon_lo, lon_hi = math.floor(min_lon / size), math.floor(max_lon / size)
+        if (lat_hi - lat_lo + 1) * (lon_hi - lon_lo + 1) <= len(cells):
+            keys = ((a, b) for a in range(lat_lo, lat_hi + 1) for b in range(lon_lo, lon_hi + 1))
+        else:
+            keys = (c for c in cells if lat_lo <= c[0] <= lat_hi and lon_lo <= c[1] <= lon_hi)
+        clusters = []
+        for key in keys:
+            aggregate = cells.get(key)
+            if aggregate is None:
+                continue
+            count, sum_lat, sum_lon, types = aggregate
+            known = [(n, t) for t, n in types.items() if t is not None and n > 0]
+            dominant = max(known)[1] if known else None
+            clusters.append({
+                "cell": key,
+                "count": count,
+                "lat": sum_lat / count / COORD_SCALE,
+                "lon": sum_lon / count / COORD_SCALE,
+                "ship_type": dominant,
+                "ship_type_count": max(known)[0] if known else 0,
+            })
+        return clusters
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["vessels"] = len(self._vessels)
+        stats["cells"] = {z: len(cells) for z, cells in self._levels.items()}
+        return stats
+
+    @staticmethod
+    def _add(cells, cell, lat, lon, category):
+        aggregate = cells.get(cell)
+        if aggregate is None:
+            cells[cell] = [1, lat, lon, Counter({category: 1})]
+            return
+        aggregate[0] += 1
+        aggregate[1] += lat
+        aggregate[2] += lon
+        aggregate[3][category] += 1
+
+    @staticmethod
+    def _remove(cells, cell, lat, lon, category):
+        aggregate = cells[cell]
+        aggregate[0] -= 1
+        if aggregate[0] == 0:
+            del cells[cell]
+            return
+        aggregate[1] -= lat
+        aggregate[2] -= lon
+        aggregate[3][category] -= 1
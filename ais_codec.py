@@ -0,0 +1,171 @@
+"""
+JSON codec shared by the AIS servers.
+
+Uses the fastest installed backend (orjson, then ujson) and falls back to the
+standard library. Set AIS_JSON_BACKEND=json|ujson|orjson to force one.
+
+    loads(data)          str or bytes in, Python object out
+    dumps(obj)           Python object in, str out (for send_text)
+    dumps_bytes(obj)     Python object in, UTF-8 bytes out (for files/sockets)
+
+Run `python ais_codec.py [ais_stream.log]` to benchmark every installed
+backend on recorded PositionReport frames.
+"""
+import json
+import os
+import sys
+import time
+
+
+class _StdlibBackend:
+    name = "json"
+
+    @staticmethod
+    def loads(data):
+        return json.loads(data)
+
+    @staticmethod
+    def dumps(obj, indent=None):
+        return json.dumps(obj, indent=indent)
+
+    @staticmethod
+    def dumps_bytes(obj):
+        return json.dumps(obj).encode("utf-8")
+
+
+class _UjsonBackend:
+    name = "ujson"
+
+    def __init__(self, module):
+        self._ujson = module
+
+    def loads(self, data):
+        return self._ujson.loads(data)
+
+    def dumps(self, obj, indent=None):
+        if indent is None:
+            return self._ujson.dumps(obj, ensure_ascii=False)
+        return self._ujson.dumps(obj, ensure_ascii=False, indent=indent)
+
+    def dumps_bytes(self, obj):
+        return self._ujson.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+class _OrjsonBackend:
+    name = "orjson"
+
+    def __init__(self, module):
+        self._orjson = module
+        # History points are keyed by int MMSI in places and may carry numpy scalars
+        self._options = module.OPT_NON_STR_KEYS | module.OPT_SERIALIZE_NUMPY
+
+    def loads(self, data):
+        return self._orjson.loads(data)
+
+    def dumps(self, obj, indent=None):
+        if indent is None:
+            return self._orjson.dumps(obj, option=self._options).decode("utf-8")
+        if indent == 2:
+            return self._orjson.dumps(obj, option=self._options | self._orjson.OPT_INDENT_2).decode("utf-8")
+        # orjson only supports 2-space indentation
+        return json.dumps(obj, indent=indent)
+
+    def dumps_bytes(self, obj):
+        return self._orjson.dumps(obj, option=self._options)
+
+
+def _load_backends():
+    backends = {}
+    try:
+        import orjson
+        backends["orjson"] = _OrjsonBackend(orjson)
+    except ImportError:
+        pass
+    try:
+        import ujson
+        backends["ujson"] = _UjsonBackend(ujson)
+    except ImportError:
+        pass
+    backends["json"] = _StdlibBackend()
+    return backends
+
+
+_BACKENDS = _load_backends()
+
+
+def available_backends():
+    """Names of the installed backends, fastest first."""
+    return list(_BACKENDS)
+
+
+def get_backend(name=None):
+    """Return the named backend, or the preferred one if name is None."""
+    if name is None:
+        name = os.getenv("AIS_JSON_BACKEND")
+    if name:
+        if name not in _BACKENDS:
+            raise ValueError(f"JSON backend {name!r} is not installed (available: {available_backends()})")
+        return _BACKENDS[name]
+    return next(iter(_BACKENDS.values()))
+
+
+_backend = get_backend()
+BACKEND = _backend.name
+loads = _backend.loads
+dumps = _backend.dumps
+dumps_bytes = _backend.dumps_bytes
+
+
+# --- Benchmark ---
+def _load_position_frames(path, limit):
+    frames = []
+    if path and os.path.exists(path):
+        with open(path, "rb") as f:
+            for line in f:
+                if b'"PositionReport"' in line:
+                    frames.append(line.rstrip(b"\n"))
+                    if len(frames) >= limit:
+                        break
+    if frames:
+        return frames
+    print(f"No PositionReport frames found in {path!r}; using a synthetic frame")
+    sample = {
+        "Message": {"PositionReport": {
+            "Cog": 282.4, "CommunicationState": 59916, "Latitude": 37.80795, "Longitude": -122.41337,
+            "MessageID": 1, "NavigationalStatus": 0, "PositionAccuracy": True, "Raim": False,
+            "RateOfTurn": 0, "RepeatIndicator": 0, "Sog": 7.9, "Spare": 0,
+            "SpecialManoeuvreIndicator": 0, "Timestamp": 31, "TrueHeading": 283,
+            "UserID": 366999712, "Valid": True}},
+        "MessageType": "PositionReport",
+        "MetaData": {"MMSI": 366999712, "MMSI_String": 366999712, "ShipName": "PIER 41 FERRY       ",
+                     "latitude": 37.80795, "longitude": -122.41337,
+                     "time_utc": "2026-10-17 18:22:32.318353 +0000 UTC"}}
+    return [json.dumps(sample).encode("utf-8")] * limit
+
+
+def _rate(fn, items, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        best = min(best, time.perf_counter() - start)
+    return len(items) / best if best > 0 else float("inf")
+
+
+def benchmark(path="ais_stream.log", limit=20000):
+    frames = _load_position_frames(path, limit)
+    print(f"{len(frames)} PositionReport frames, messages/sec (best of 3)")
+    print(f"{'backend':<8} {'loads':>12} {'dumps':>12} {'dumps_bytes':>12} {'roundtrip':>12}")
+    for name in available_backends():
+        backend = _BACKENDS[name]
+        objs = [backend.loads(f) for f in frames]
+        loads_rate = _rate(backend.loads, frames)
+        dumps_rate = _rate(backend.dumps, objs)
+        bytes_rate = _rate(backend.dumps_bytes, objs)
+        roundtrip_rate = _rate(lambda f: backend.dumps_bytes(backend.loads(f)), frames)
+        print(f"{name:<8} {loads_rate:>12,.0f} {dumps_rate:>12,.0f} {bytes_rate:>12,.0f} {roundtrip_rate:>12,.0f}")
+
+
+if __name__ == "__main__":
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else "ais_stream.log")
@@ -0,0 +1,59 @@
+"""
+Duplicate suppression for position reports.
+
+The same report can arrive several times: overlapping bounding boxes,
+base stations relaying it, upstream retransmits. Each copy would run the
+profile recomputation and circle fit and be broadcast again, so reports are
+keyed on (MMSI, time bucket, quantized lat, quantized lon) and checked
+against a time-windowed hash set before dispatch.
+
+Exact copies share a key. Near-duplicates (the same position received up to
+`time_tolerance` seconds later) land in the same or the next time bucket, so
+both buckets are checked. The set is split into generations that are
+rotated every `window / 2` seconds (or when a generation reaches
+`max_keys / 2`), which bounds memory without per-key expiry bookkeeping.
+"""
+import time
+
+
+class MessageDeduper:
+    def __init__(self, window=60.0, time_tolerance=1.0, position_tolerance=1e-5, max_keys=500000):
+        self.window = window
+        self.time_tolerance = time_tolerance
+        self.position_tolerance = position_tolerance  # degrees, ~1 m
+        self.max_keys = max_keys
+        self._current = set()
+        self._previous = set()
+        self._rotated = time.monotonic()
+        self.stats = {"checked": 0, "duplicates": 0, "rotations": 0}
+
+    def _rotate(self, now):
+        self._previous = self._current
+        self._current = set()
+        self._rotated = now
+        self.stats["rotations"] += 1
+
+    def is_duplicate(self, mmsi, epoch, lat, lon):
+        """Record a position report; True if an equal or near-equal one was seen within the window."""
+        now = time.monotonic()
+        if now - self._rotated >= self.window / 2 or len(self._current) >= self.max_keys // 2:
+            self._rotate(now)
+        self.stats["checked"] += 1
+        bucket = int(epoch // self.time_tolerance)
+        qlat = round(lat / self.position_tolerance)
+        qlon = round(lon / self.position_tolerance)
+        key = (mmsi, bucket, qlat, qlon)
+        earlier = (mmsi, bucket - 1, qlat, qlon)
+        current, previous = self._current, self._previous
+        if key in current or key in previous or earlier in current or earlier in previous:
+            self.stats["duplicates"] += 1
+            current.add(key)
+            return True
+        current.add(key)
+        return False
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["hit_rate"] = round(stats["duplicates"] / stats["checked"], 4) if stats["checked"] else 0.0
+        stats["keys"] = len(self._current) + len(self._previous)
+        return stats
@@ -0,0 +1,62 @@
+import time
+
+
+class MessageDispatcher:
+    """
+    Table-driven dispatch of AIS messages by MessageType.
+
+    Handlers are registered per message type and looked up with a single dict
+    access. Per-type call counts and cumulative handler time are kept so we can
+    see which message types use the CPU.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+        self._default = None
+        self._stats = {}  # {msg_type: [count, total_seconds]}
+
+    def register(self, *message_types):
+        """Decorator registering a handler for one or more message types."""
+        def decorator(handler):
+            for message_type in message_types:
+                self._handlers[message_type] = handler
+            return handler
+        return decorator
+
+    def register_default(self, handler):
+        """Decorator registering the handler used for unregistered types."""
+        self._default = handler
+        return handler
+
+    def handles(self, message_type):
+        return message_type in self._handlers
+
+    def dispatch(self, message_type, *args):
+        handler = self._handlers.get(message_type, self._default)
+        if handler is None:
+            return None
+        start = time.perf_counter()
+        try:
+            return handler(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            stat = self._stats.get(message_type)
+            if stat is None:
+                self._stats[message_type] = [1, elapsed]
+            else:
+                stat[0] += 1
+                stat[1] += elapsed
+
+    def get_stats(self):
+        """Per-type counts and handler time, busiest type first."""
+        stats = {}
+        for message_type, (count, total) in sorted(self._stats.items(), key=lambda kv: kv[1][1], reverse=True):
+            stats[message_type] = {
+                "count": count,
+                "total_ms": round(total * 1000, 3),
+                "avg_us": round(total / count * 1e6, 2) if count else 0.0,
+            }
+        return stats
+
+    def reset_stats(self):
+        self._stats.clear()
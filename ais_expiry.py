@@ -0,0 +1,165 @@
+"""
+Expiry of silent vessels and global caps for live per-MMSI state.
+
+The sweeper keeps every MMSI in least-recently-updated order (touch() on
+each message). Structures are registered with a TTL: a sweep walks the
+order from the least recently updated vessel and removes it from each
+structure whose TTL it has outlived, stopping at the first vessel that is
+still fresh for every structure. Caps bound the summed size of a structure
+(e.g. history points and bytes). Each cap keeps its vessels' last measured
+sizes in the same recency order, plus running totals. touch() re-measures
+the vessel, so it is called after the vessel's entry changed. When a cap is
+exceeded, vessels are popped from the front of its order until it fits.
+
+Sweeps run from a background task (and between batches in worker
+processes); each one is proportional to the number of silent or evicted
+vessels, not to the fleet.
+"""
+import time
+from collections import OrderedDict
+
+
+class ExpirySweeper:
+    def __init__(self, interval=30.0):
+        self.interval = interval
+        self._activity = OrderedDict()  # {mmsi: last update (monotonic)}, least recent first
+        self._structures = []  # [(name, container, ttl, remove)]
+        self._caps = []  # [Cap]
+        self._after_sweep = []  # callbacks run after sweeps that evicted something
+        self._last_sweep = time.monotonic()
+        self.evicted = {}
+        self.stats = {"sweeps": 0, "sweep_ms": None}
+
+    def register(self, name, container, ttl, remove=None):
+        """Expire `container[mmsi]` after `ttl` seconds without an update (None or 0: never)."""
+        self._structures.append((name, container, ttl or None, remove or (lambda mmsi: container.pop(mmsi, None))))
+        self.evicted.setdefault(name, 0)
+
+    def cap(self, name, container, limits, measure, remove=None):
+        """
+        Keep the per-vessel sizes `measure(container[mmsi])` (a tuple) summed
+        below `limits` (same length, None or 0 for no limit) by evicting the
+        least recently updated vessels from `container`.
+        """
+        self._caps.append(Cap(name, container, limits, measure, remove or (lambda mmsi: container.pop(mmsi, None))))
+        self.evicted.setdefault(name, 0)
+
+    def after_sweep(self, callback):
+        """Call `callback()` after each sweep that evicted something (e.g. to prune what only evicted vessels used)."""
+        self._after_sweep.append(callback)
+
+    def touch(self, mmsi, now=None):
+        """Record an update of `mmsi`; call it after the update so capped sizes are measured as they are now."""
+        self._activity[mmsi] = now if now is not None else time.monotonic()
+        self._activity.move_to_end(mmsi)
+        for cap in self._caps:
+            cap.measure(mmsi, recent=True)
+
+    def resized(self, mmsi):
+        """Re-measure `mmsi` for the caps after a change that is not an update (e.g. compaction)."""
+        for cap in self._caps:
+            cap.measure(mmsi)
+
+    def clear(self):
+        self._activity.clear()
+        for cap in self._caps:
+            cap.clear()
+
+    def ages(self, now=None):
+        """[(mmsi, seconds since its last update)], least recently updated first."""
+        now = now if now is not None else time.monotonic()
+        return [(mmsi, now - seen) for mmsi, seen in self._activity.items()]
+
+    def sweep_if_due(self, now=None):
+        now = now if now is not None else time.monotonic()
+        if now - self._last_sweep >= self.interval:
+            self.sweep(now)
+
+    def sweep(self, now=None):
+        now = now if now is not None else time.monotonic()
+        start = time.perf_counter()
+        self._last_sweep = now
+        evicted = sum(self.evicted.values())
+        self._expire(now)
+        for cap in self._caps:
+            self.evicted[cap.name] += cap.enforce()
+        if sum(self.evicted.values()) > evicted:
+            for callback in self._after_sweep:
+                callback()
+        self.stats["sweeps"] += 1
+        self.stats["sweep_ms"] = round((time.perf_counter() - start) * 1000, 3)
+
+    def _expire(self, now):
+        cutoffs = [(name, container, now - ttl, remove) for name, container, ttl, remove in self._structures if ttl]
+        if not cutoffs:
+            return
+        newest_cutoff = max(cutoff for _, _, cutoff, _ in cutoffs)
+        containers = [container for _, container, _, _ in self._structures] + [cap.container for cap in self._caps]
+        forgotten = []
+        for mmsi, seen in self._activity.items():
+            if seen >= newest_cutoff:
+                break
+            for name, container, cutoff, remove in cutoffs:
+                if seen < cutoff and mmsi in container:
+                    remove(mmsi)
+                    self.evicted[name] += 1
+            for cap in self._caps:
+                cap.measure(mmsi)
+            if not any(mmsi in container for container in containers):
+                forgotten.append(mmsi)
+        for mmsi in forgotten:
+            del self._activity[mmsi]
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["tracked"] = len(self._activity)
+        stats["evicted"] = dict(self.evicted)
+        stats["ttl"] = {name: ttl for name, _, ttl, _ in self._structures}
+        stats["sizes"] = {name: len(container) for name, container, _, _ in self._structures}
+        stats["caps"] = {cap.name: {"limits": list(cap.limits), "usage": list(cap.totals)} for cap in self._caps}
+        return stats
+
+
+class Cap:
+    """Running totals of `measure(container[mmsi])` over a container, with the sizes in recency order."""
+
+    def __init__(self, name, container, limits, measure, remove):
+        self.name = name
+        self.container = container
+        self.limits = tuple(limits)
+        self._measure = measure
+        self._remove = remove
+        self._sizes = OrderedDict()  # {mmsi: sizes when last measured}, least recently updated first
+        self.totals = [0] * len(self.limits)
+
+    def measure(self, mmsi, recent=False):
+        """Update `mmsi`'s size (forgotten if it left the container); `recent` moves it to the end of the order."""
+        old = self._sizes.pop(mmsi, None) if recent else self._sizes.get(mmsi)
+        value = self.container.get(mmsi)
+        new = self._measure(value) if value is not None else None
+        totals = self.totals
+        for i in range(len(totals)):
+            totals[i] += (new[i] if new is not None else 0) - (old[i] if old is not None else 0)
+        if new is None:
+            self._sizes.pop(mmsi, None)
+        else:
+            self._sizes[mmsi] = new
+
+    def over(self):
+        return any(limit and total > limit for total, limit in zip(self.totals, self.limits))
+
+    def enforce(self):
+        """Evict the least recently updated vessels until the totals fit; returns the number evicted."""
+        evicted = 0
+        while self._sizes and self.over():
+            mmsi, sizes = self._sizes.popitem(last=False)
+            for i, size in enumerate(sizes):
+                self.totals[i] -= size
+            if mmsi in self.container:
+                self._remove(mmsi)
+                evicted += 1
+        return evicted
+
+    def clear(self):
+        self._sizes.clear()
+        self.totals = [0] * len(self.limits)
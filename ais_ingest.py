@@ -0,0 +1,92 @@
+import asyncio
+
+
+async def drain_batch(queue, max_items, max_wait):
+    """
+    Wait for the next item on `queue`, then keep pulling until `max_items`
+    have been collected or `max_wait` seconds have passed since the first one.
+    Returns the batch as a list (never empty).
+    """
+    loop = asyncio.get_running_loop()
+    batch = [await queue.get()]
+    deadline = loop.time() + max_wait
+    while len(batch) < max_items:
+        try:
+            batch.append(queue.get_nowait())
+            continue
+        except asyncio.QueueEmpty:
+            pass
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), timeout))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+
+COALESCE = "coalesce"  # keep only the newest pending report per key
+LOSSLESS = "lossless"  # never coalesced or dropped
+DROPPABLE = "droppable"  # dropped when the queue is full
+
+
+class CoalescingQueue(asyncio.Queue):
+    """
+    Bounded ingest queue that sheds load instead of falling further behind.
+
+    Below `coalesce_depth` it behaves like a FIFO queue. Past it, each new item
+    is classified by `classify(item) -> (policy, key)`: a COALESCE item whose
+    key already has a pending entry replaces that entry's payload in place
+    (keeping its place in line), so only the latest report per vessel is
+    processed. When `limit` is reached, COALESCE and DROPPABLE items are
+    rejected with QueueFull while LOSSLESS items are still admitted.
+    """
+
+    def __init__(self, limit, coalesce_depth=None, classify=None):
+        super().__init__()
+        self.limit = limit
+        self.coalesce_depth = coalesce_depth if coalesce_depth is not None else limit // 2
+        self.classify = classify or (lambda item: (LOSSLESS, None))
+        self.stats = {"coalesced": 0, "dropped": 0, "overflow": 0, "max_depth": 0}
+
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self._pending = {}  # key -> slot of the queued COALESCE item
+
+    def _get(self):
+        slot = super()._get()
+        if slot[0] is not None and self._pending.get(slot[0]) is slot:
+            del self._pending[slot[0]]
+        return slot[1]
+
+    def put_nowait(self, item):
+        depth = self.qsize()
+        if depth < self.coalesce_depth:
+            slot = [None, item]
+        else:
+            policy, key = self.classify(item)
+            if policy == COALESCE and key is not None:
+                slot = self._pending.get(key)
+                if slot is not None:
+                    slot[1] = item
+                    self.stats["coalesced"] += 1
+                    return
+            if depth >= self.limit:
+                if policy != LOSSLESS:
+                    self.stats["dropped"] += 1
+                    raise asyncio.QueueFull
+                self.stats["overflow"] += 1
+            slot = [key if policy == COALESCE else None, item]
+            if slot[0] is not None:
+                self._pending[slot[0]] = slot
+        super().put_nowait(slot)
+        if depth + 1 > self.stats["max_depth"]:
+            self.stats["max_depth"] = depth + 1
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["depth"] = self.qsize()
+        stats["limit"] = self.limit
+        stats["coalesce_depth"] = self.coalesce_depth
+        return stats
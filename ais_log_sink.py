@@ -0,0 +1,207 @@
+"""
+Buffered, rotating writer for ais_stream.log.
+
+Records are handed to a background thread which commits them in groups
+(every `batch_records` records or `batch_ms` milliseconds, whichever comes
+first), so the event loop never does file I/O. The active segment keeps the
+configured name (e.g. ais_stream.log); closed segments are renamed to
+ais_stream.<opened UTC>.log and optionally gzip-compressed.
+
+When the queue is full, the block policy waits for room in a worker thread,
+so only the caller awaiting write_batch() is held back, not the event loop.
+"""
+import asyncio
+import gzip
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+
+POLICY_DROP = "drop"  # discard records when the writer falls behind
+POLICY_BLOCK = "block"  # make write_batch() wait up to block_timeout for space, then discard
+
+
+def segment_name(path, opened):
+    """Name of the closed segment for an active file opened at `opened` (UTC datetime)."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{opened.strftime('%Y%m%dT%H%M%SZ')}{ext}"
+
+
+def list_segments(path, active=True):
+    """Closed segments (compressed or not) followed by the active file (unless not `active`), oldest first."""
+    directory = os.path.dirname(path) or "."
+    root, ext = os.path.splitext(os.path.basename(path))
+    prefix = root + "."
+    segments = []
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if not name.startswith(prefix) or name == os.path.basename(path):
+                continue
+            stamp = name[len(prefix):]
+            if stamp.endswith(".gz"):
+                stamp = stamp[:-3]
+            if not stamp.endswith(ext):
+                continue
+            stamp = stamp[:len(stamp) - len(ext)] if ext else stamp
+            base, _, suffix = stamp.partition("-")
+            if len(base) == 16 and base[8] == "T" and base[:8].isdigit() and (not suffix or suffix.isdigit()):
+                segments.append(((base, int(suffix or 0)), os.path.join(directory, name)))
+    segments.sort()
+    paths = [p for _, p in segments]
+    if active and os.path.exists(path):
+        paths.append(path)
+    return paths
+
+
+class AsyncLogSink:
+    def __init__(self, path, batch_records=500, batch_ms=200, max_bytes=256 * 1024 * 1024,
+                 rotate_daily=True, compress=True, policy=POLICY_DROP, max_pending=50000,
+                 block_timeout=1.0):
+        if policy not in (POLICY_DROP, POLICY_BLOCK):
+            raise ValueError(f"Unknown log sink policy: {policy}")
+        self.path = path
+        self.batch_records = batch_records
+        self.batch_ms = batch_ms
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.compress = compress
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._file = None
+        self._opened = None
+        self._size = 0
+        self._stats = {"written": 0, "dropped": 0, "commits": 0, "rotations": 0, "errors": 0}
+
+    # --- Producer side (event loop) ---
+    def start(self):
+        if self._thread is None:
+            self._open()
+            self._thread = threading.Thread(target=self._run, name="ais-log-sink", daemon=True)
+            self._thread.start()
+        return self
+
+    async def write_batch(self, records):
+        """Queue records (bytes, without trailing newline). Returns how many were dropped."""
+        dropped = 0
+        deadline = None
+        for record in records:
+            try:
+                self._queue.put_nowait(record)
+                continue
+            except queue.Full:
+                pass
+            if self.policy == POLICY_BLOCK:
+                # One block_timeout for the whole batch, not per record
+                if deadline is None:
+                    deadline = time.monotonic() + self.block_timeout
+                timeout = deadline - time.monotonic()
+                if timeout > 0:
+                    try:
+                        await asyncio.to_thread(self._queue.put, record, True, timeout)
+                        continue
+                    except queue.Full:
+                        pass
+            self._stats["dropped"] += 1
+            dropped += 1
+        return dropped
+
+    def close(self):
+        """Flush everything still queued and stop the writer thread."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def get_stats(self):
+        stats = dict(self._stats)
+        stats["pending"] = self._queue.qsize()
+        stats["segment_bytes"] = self._size
+        stats["policy"] = self.policy
+        return stats
+
+    # --- Writer thread ---
+    def _run(self):
+        while True:
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=self.batch_ms / 1000))
+            except queue.Empty:
+                self._maybe_rotate()
+                continue
+            deadline = time.monotonic() + self.batch_ms / 1000
+            while len(batch) < self.batch_records and batch[-1] is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            records = batch[:-1] if stop else batch
+            if records:
+                self._commit(records)
+            if stop:
+                return
+            self._maybe_rotate()
+
+    def _commit(self, records):
+        data = b"\n".join(records) + b"\n"
+        try:
+            self._file.write(data)
+            self._file.flush()
+        except OSError as e:
+            self._stats["errors"] += 1
+            print("ais_stream.log write error:", e)
+            return
+        self._size += len(data)
+        self._stats["written"] += len(records)
+        self._stats["commits"] += 1
+
+    def _open(self):
+        self._file = open(self.path, "ab")
+        self._size = self._file.tell()
+        if self._size:
+            self._opened = datetime.fromtimestamp(os.path.getmtime(self.path), tz=timezone.utc)
+        else:
+            self._opened = datetime.now(timezone.utc)
+        self._maybe_rotate()
+
+    def _maybe_rotate(self):
+        now = datetime.now(timezone.utc)
+        if not self._size:
+            self._opened = now
+            return
+        if self._size < self.max_bytes and not (self.rotate_daily and now.date() != self._opened.date()):
+            return
+        self._file.close()
+        closed = segment_name(self.path, self._opened)
+        suffix = 1
+        while os.path.exists(closed) or os.path.exists(closed + ".gz"):
+            root, ext = os.path.splitext(segment_name(self.path, self._opened))
+            closed = f"{root}-{suffix}{ext}"
+            suffix += 1
+        os.replace(self.path, closed)
+        self._stats["rotations"] += 1
+        self._file = open(self.path, "ab")
+        self._size = 0
+        self._opened = now
+        if self.compress:
+            threading.Thread(target=self._compress, args=(closed,), daemon=True).start()
+
+    def _compress(self, path):
+        try:
+            with open(path, "rb") as src, gzip.open(path + ".gz.tmp", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(path + ".gz.tmp", path + ".gz")
+            os.remove(path)
+        except OSError as e:
+            self._stats["errors"] += 1
+            print("ais_stream.log compression error:", e)
@@ -0,0 +1,189 @@
+"""
+MMSI decoding: Maritime Identification Digits (MID), flag and station class.
+
+The MID sits at a different position depending on the kind of station
+(ITU-R M.585): MIDxxxxxx for ships, 0MIDxxxxx for groups, 00MIDxxxx for
+base/coast stations, 111MIDxxx for SAR aircraft, 8MIDxxxxx for handhelds,
+98MIDxxxx for craft associated with a parent ship and 99MIDxxxx for aids to
+navigation. MMSIs arrive as integers, so leading zeros are already gone and
+every class is a range of values.
+
+Flags are small integer codes into FLAGS (0 = unknown), looked up through a
+1000-entry MID array. decode_mmsi() handles one MMSI and is memoized for the
+per-message path; decode_mmsis() decodes a whole array (live fleet, archive
+segment columns) with a handful of vectorized comparisons.
+
+    python ais_mmsi.py
+
+benchmarks both against the previous string-slicing parser.
+"""
+import numpy as np
+
+# MID to country mapping (partial, can be extended)
+MID_TO_COUNTRY = {
+    201: 'Albania', 202: 'Andorra', 203: 'Austria', 204: 'Azores', 205: 'Belgium',
+    206: 'Belarus', 207: 'Bulgaria', 208: 'Vatican', 209: 'Cyprus', 210: 'Cyprus',
+    211: 'Germany', 212: 'Cyprus', 213: 'Georgia', 214: 'Moldova', 215: 'Malta',
+    218: 'Germany', 219: 'Denmark', 220: 'Denmark', 224: 'Spain', 225: 'Spain',
+    226: 'France', 227: 'France', 228: 'France', 229: 'Malta', 230: 'Finland',
+    231: 'Faeroe Islands', 232: 'United Kingdom', 233: 'United Kingdom', 234: 'United Kingdom',
+    235: 'United Kingdom', 236: 'Gibraltar', 237: 'Greece', 238: 'Croatia', 239: 'Greece',
+    240: 'Greece', 241: 'Greece', 242: 'Morocco', 243: 'Hungary', 244: 'Netherlands',
+    245: 'Netherlands', 246: 'Netherlands', 247: 'Italy', 248: 'Malta', 249: 'Malta',
+    250: 'Ireland', 251: 'Iceland', 252: 'Liechtenstein', 253: 'Luxembourg', 254: 'Monaco',
+    255: 'Portugal', 256: 'Malta', 257: 'Norway', 258: 'Norway', 259: 'Norway',
+    261: 'Poland', 262: 'Montenegro', 263: 'Portugal', 264: 'Romania', 265: 'Sweden',
+    266: 'Sweden', 267: 'Slovakia', 268: 'San Marino', 269: 'Switzerland', 270: 'Czech Republic',
+    271: 'Turkey', 272: 'Ukraine', 273: 'Russia', 274: 'Macedonia', 275: 'Latvia',
+    276: 'Estonia', 277: 'Lithuania', 278: 'Slovenia', 279: 'Serbia', 301: 'Anguilla',
+    303: 'Alaska', 305: 'Antigua and Barbuda', 306: 'Netherlands Antilles', 307: 'Aruba',
+    308: 'Bahamas', 309: 'Bahamas', 310: 'Bermuda', 311: 'Bahamas', 316: 'Canada',
+    319: 'Cayman Islands', 330: 'Greenland', 338: 'United States', 366: 'United States',
+    367: 'United States', 368: 'United States', 369: 'United States', 370: 'Panama',
+    371: 'Panama', 372: 'Panama', 373: 'Panama', 375: 'Saint Vincent and the Grenadines',
+    376: 'Saint Vincent and the Grenadines', 377: 'Saint Vincent and the Grenadines',
+    378: 'British Virgin Islands', 379: 'British Virgin Islands', 401: 'Afghanistan',
+    403: 'Saudi Arabia', 405: 'Bangladesh', 408: 'Iran', 412: 'China', 413: 'China',
+    414: 'China', 416: 'Taiwan', 417: 'Sri Lanka', 419: 'India', 422: 'Japan',
+    423: 'Japan', 431: 'Hong Kong', 432: 'South Korea', 440: 'Azerbaijan', 441: 'Kazakhstan',
+    450: 'Russian Federation', 451: 'Russian Federation', 452: 'Russian Federation',
+    453: 'Russian Federation', 455: 'Mongolia', 456: 'North Korea', 457: 'North Korea',
+    470: 'Turkey', 471: 'Syria', 472: 'Lebanon', 473: 'Jordan', 475: 'Yemen',
+    477: 'Hong Kong', 478: 'Bosnia and Herzegovina', 501: 'Australia', 503: 'Australia',
+    506: 'Myanmar', 508: 'Papua New Guinea', 510: 'Micronesia', 511: 'Palau',
+    512: 'Nauru', 514: 'Tuvalu', 515: 'Cambodia', 516: 'Christmas Island',
+    520: 'Thailand', 525: 'Singapore', 529: 'Malaysia', 533: 'Malaysia', 536: 'Brunei',
+    538: 'Philippines', 542: 'South Pacific', 544: 'New Zealand', 546: 'New Zealand',
+    548: 'Cook Islands', 553: 'Fiji', 555: 'Tonga', 557: 'New Caledonia',
+    559: 'French Polynesia', 561: 'Wallis and Futuna', 563: 'Singapore', 564: 'Singapore',
+    565: 'Singapore', 566: 'Singapore', 567: 'Singapore', 570: 'Solomon Islands',
+    572: 'Vanuatu', 574: 'Guam', 576: 'Samoa', 577: 'American Samoa', 601: 'South Africa',
+    603: 'Angola', 605: 'Algeria', 607: 'Saint Paul', 608: 'Ascension Island',
+    609: 'Burundi', 610: 'Benin', 611: 'Botswana', 612: 'Central African Republic',
+    613: 'Cameroon', 615: 'Congo', 616: 'Comoros', 617: 'Congo', 618: 'Djibouti',
+    619: 'Egypt', 620: 'Ethiopia', 621: 'Gabon', 622: 'Gambia', 624: 'Ghana',
+    625: 'Guinea', 626: 'Ivory Coast', 627: 'Kenya', 629: 'Madagascar', 630: 'Malawi',
+    631: 'Mali', 632: 'Mauritania', 633: 'Mauritius', 634: 'Morocco', 635: 'Mozambique',
+    636: 'Namibia', 637: 'Niger', 638: 'Nigeria', 642: 'Seychelles', 644: 'Sudan',
+    645: 'Swaziland', 647: 'Tanzania', 649: 'Togo', 650: 'Tunisia', 654: 'Zambia',
+    655: 'Zimbabwe', 657: 'South Sudan', 659: 'Eritrea', 660: 'Mayotte', 661: 'Réunion',
+    662: 'Saint Pierre and Miquelon', 663: 'Saint Helena', 664: 'Saint Kitts and Nevis',
+    665: 'Anguilla', 666: 'Antigua and Barbuda', 667: 'Aruba', 668: 'Bahamas',
+    669: 'Barbados', 670: 'Bermuda', 672: 'British Virgin Islands', 674: 'Cayman Islands',
+    675: 'Cuba', 676: 'Dominica', 677: 'Dominican Republic', 678: 'Grenada',
+    679: 'Guadeloupe', 680: 'Haiti', 682: 'Jamaica', 683: 'Martinique', 684: 'Montserrat',
+    685: 'Puerto Rico', 686: 'Saint Lucia', 687: 'Saint Vincent and the Grenadines',
+    688: 'Trinidad and Tobago', 689: 'Turks and Caicos Islands', 690: 'Virgin Islands',
+    700: 'Argentina', 701: 'Argentina', 710: 'Brazil', 720: 'Chile', 725: 'Paraguay',
+    730: 'Peru', 735: 'Uruguay', 740: 'Suriname', 745: 'Venezuela', 750: 'Falkland Islands',
+    755: 'Guyana', 760: 'Ecuador', 765: 'Bolivia', 770: 'Colombia', 775: 'Panama',
+    780: 'Trinidad and Tobago', 800: 'Alaska', 803: 'Hawaii', 810: 'Guam', 820: 'Northern Mariana Islands',
+    830: 'Palau', 850: 'United States', 857: 'United States', 870: 'United States', 875: 'United States',
+    880: 'United States', 885: 'United States', 890: 'United States', 895: 'United States',
+}
+
+
+FLAGS = [None] + sorted(set(MID_TO_COUNTRY.values()))  # flag code -> country
+FLAG_CODES = {flag: code for code, flag in enumerate(FLAGS)}
+MID_FLAG_CODES = np.zeros(1000, dtype=np.uint16)
+for _mid, _country in MID_TO_COUNTRY.items():
+    MID_FLAG_CODES[_mid] = FLAG_CODES[_country]
+_MID_FLAG_LIST = MID_FLAG_CODES.tolist()  # scalar lookups without numpy indexing overhead
+
+CLASS_NAMES = ["invalid", "ship", "group", "base_station", "sar_aircraft", "handheld", "associated_craft", "aton", "sart"]
+(CLASS_INVALID, CLASS_SHIP, CLASS_GROUP, CLASS_BASE_STATION, CLASS_SAR_AIRCRAFT, CLASS_HANDHELD,
+ CLASS_ASSOCIATED_CRAFT, CLASS_ATON, CLASS_SART) = range(len(CLASS_NAMES))
+
+# (class, first MMSI, end, divisor): MID = MMSI // divisor % 1000; SART/MOB/EPIRB (970, 972, 974) carry no MID
+_RULES = (
+    (CLASS_SHIP, 200_000_000, 800_000_000, 1_000_000),
+    (CLASS_GROUP, 20_000_000, 80_000_000, 100_000),
+    (CLASS_BASE_STATION, 2_000_000, 8_000_000, 10_000),
+    (CLASS_SAR_AIRCRAFT, 111_000_000, 112_000_000, 1_000),
+    (CLASS_HANDHELD, 800_000_000, 900_000_000, 100_000),
+    (CLASS_ASSOCIATED_CRAFT, 980_000_000, 990_000_000, 10_000),
+    (CLASS_ATON, 990_000_000, 1_000_000_000, 10_000),
+    (CLASS_SART, 970_000_000, 975_000_000, None),
+)
+
+
+MEMO_SIZE = 1 << 17  # MMSIs remembered by decode_mmsi (the memo is cleared when full)
+_decoded = {}  # {mmsi: (mid, flag code, class code)}
+
+
+def decode_mmsi(mmsi):
+    """(MID or None, flag code, class code) of one MMSI (int or digit string); memoized."""
+    decoded = _decoded.get(mmsi)
+    if decoded is None:
+        if len(_decoded) >= MEMO_SIZE:
+            _decoded.clear()
+        decoded = _decoded[mmsi] = _decode(mmsi)
+    return decoded
+
+
+def _decode(mmsi):
+    try:
+        value = int(mmsi)
+    except (TypeError, ValueError):
+        return None, 0, CLASS_INVALID
+    for mmsi_class, first, end, divisor in _RULES:
+        if first <= value < end:
+            if divisor is None:
+                return None, 0, mmsi_class
+            mid = value // divisor % 1000
+            return mid, _MID_FLAG_LIST[mid], mmsi_class
+    return None, 0, CLASS_INVALID
+
+
+def decode_mmsis(mmsis):
+    """(MID, flag code, class code) arrays for an array of MMSIs; MID 0 where there is none."""
+    values = np.asarray(mmsis, dtype=np.int64)
+    mids = np.zeros(values.shape, dtype=np.int16)
+    classes = np.full(values.shape, CLASS_INVALID, dtype=np.uint8)
+    for mmsi_class, first, end, divisor in _RULES:
+        match = (values >= first) & (values < end)
+        classes[match] = mmsi_class
+        if divisor is not None:
+            mids[match] = values[match] // divisor % 1000
+    return mids, MID_FLAG_CODES[mids], classes
+
+
+def _parse_mmsi_strings(mmsi):
+    """The parser decode_mmsi replaced (first three digits of a 9-digit MMSI), for the benchmark."""
+    try:
+        mmsi_str = str(mmsi)
+        if len(mmsi_str) != 9 or not mmsi_str.isdigit():
+            return {"mmsi": mmsi, "flag": None, "mid": None}
+        mid = int(mmsi_str[0:3])
+        return {"mmsi": mmsi, "flag": MID_TO_COUNTRY.get(mid, None), "mid": mid}
+    except Exception:
+        return {"mmsi": mmsi, "flag": None, "mid": None}
+
+
+def _benchmark():
+    import time
+
+    rng = np.random.default_rng(1)
+    # A live fleet of 50k vessels reporting repeatedly, plus base stations, AtoNs and SAR aircraft
+    fleet = np.concatenate([rng.integers(200_000_000, 800_000_000, 50000), rng.integers(2_000_000, 8_000_000, 500),
+                            rng.integers(990_000_000, 1_000_000_000, 500), rng.integers(111_000_000, 112_000_000, 50)])
+    stream = rng.choice(fleet, 1_000_000).tolist()
+    mids, flags, classes = decode_mmsis(fleet)
+    for i, mmsi in enumerate(fleet.tolist()):
+        mid, flag, mmsi_class = decode_mmsi(mmsi)
+        assert (mid or 0, flag, mmsi_class) == (mids[i], flags[i], classes[i]), mmsi
+    _decoded.clear()
+    for name, run in (("string parser", _parse_mmsi_strings), ("decode_mmsi cold", decode_mmsi),
+                      ("decode_mmsi warm", decode_mmsi)):
+        start = time.perf_counter()
+        for mmsi in stream:
+            run(mmsi)
+        print(f"{name:<18}{(time.perf_counter() - start) / len(stream) * 1e9:8.0f} ns/message")
+    array = np.array(stream)
+    start = time.perf_counter()
+    decode_mmsis(array)
+    print(f"{'decode_mmsis':<18}{(time.perf_counter() - start) / len(stream) * 1e9:8.1f} ns/MMSI ({len(stream)} at once)")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,245 @@
+"""
+k-nearest-vessel and radius search.
+
+Positions are projected onto the unit sphere (x, y, z), where straight-line
+(chord) distance orders points exactly like great-circle distance and there
+is no seam at the antimeridian or the poles. A KD-tree over those points is
+rebuilt from a snapshot of the latest positions and swapped in atomically,
+so queries never wait for a rebuild. scipy's cKDTree is used when installed;
+otherwise a small numpy KD-tree with the same two queries is used.
+
+    python ais_nearest.py [vessels]
+
+benchmarks build time and query latency (default 50k vessels).
+"""
+import heapq
+import math
+import time
+
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # optional
+    cKDTree = None
+
+EARTH_RADIUS_NM = 3440.065
+LEAF_SIZE = 32
+
+
+def to_unit_vectors(lats, lons):
+    lat = np.radians(np.asarray(lats, dtype=float))
+    lon = np.radians(np.asarray(lons, dtype=float))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def chord_to_nm(chord):
+    return 2 * np.arcsin(np.minimum(np.asarray(chord) / 2, 1.0)) * EARTH_RADIUS_NM
+
+
+def nm_to_chord(nm):
+    return 2 * math.sin(min(nm / EARTH_RADIUS_NM, math.pi) / 2)
+
+
+def great_circle_nm(lat1, lon1, lat2, lon2):
+    """Haversine distance in nautical miles."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_NM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class NumpyKDTree:
+    """Static KD-tree (median splits on the widest axis, bounding box per node)."""
+
+    def __init__(self, points, leaf_size=LEAF_SIZE):
+        self.points = np.array(points, dtype=float)
+        self.index = np.arange(len(self.points))
+        self.leaf_size = leaf_size
+        self._nodes = []  # [start, end, box min, box max, left, right]
+        if len(self.points):
+            self._build(0, len(self.points))
+
+    def _build(self, start, end):
+        pts = self.points[start:end]
+        mins, maxs = pts.min(axis=0), pts.max(axis=0)
+        node = len(self._nodes)
+        self._nodes.append([start, end, tuple(mins.tolist()), tuple(maxs.tolist()), -1, -1])
+        if end - start > self.leaf_size:
+            mid = (start + end) // 2
+            order = np.argpartition(pts[:, int(np.argmax(maxs - mins))], mid - start)
+            self.points[start:end] = pts[order]
+            self.index[start:end] = self.index[start:end][order]
+            left = self._build(start, mid)
+            right = self._build(mid, end)
+            self._nodes[node][4:] = [left, right]
+        return node
+
+    @staticmethod
+    def _box_distance(x, mins, maxs):
+        d = 0.0
+        for v, lo, hi in zip(x, mins, maxs):
+            if v < lo:
+                d += (lo - v) ** 2
+            elif v > hi:
+                d += (v - hi) ** 2
+        return math.sqrt(d)
+
+    def query(self, x, k, bound=math.inf):
+        """[(distance, index)] of the k nearest points within `bound`, nearest first."""
+        if not self._nodes:
+            return []
+        x = tuple(float(v) for v in x)
+        xa = np.array(x)
+        best = []  # max-heap of (-distance, index)
+        pending = [(0.0, 0)]
+        nodes = self._nodes
+        while pending:
+            box_distance, node = heapq.heappop(pending)
+            limit = -best[0][0] if len(best) == k else bound
+            if box_distance > limit:
+                break
+            start, end, _, _, left, right = nodes[node]
+            if left < 0:
+                d = np.sqrt(((self.points[start:end] - xa) ** 2).sum(axis=1))
+                if len(d) > k:
+                    part = np.argpartition(d, k - 1)[:k]
+                else:
+                    part = range(len(d))
+                for j in part:
+                    dj = float(d[j])
+                    if dj > bound:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-dj, int(self.index[start + j])))
+                    elif dj < -best[0][0]:
+                        heapq.heapreplace(best, (-dj, int(self.index[start + j])))
+                continue
+            for child in (left, right):
+                _, _, mins, maxs, _, _ = nodes[child]
+                heapq.heappush(pending, (self._box_distance(x, mins, maxs), child))
+        return sorted((-d, i) for d, i in best)
+
+    def query_ball_point(self, x, r):
+        """Indexes of the points within distance `r` of `x`."""
+        if not self._nodes:
+            return []
+        x = tuple(float(v) for v in x)
+        xa = np.array(x)
+        found = []
+        stack = [0]
+        nodes = self._nodes
+        while stack:
+            start, end, mins, maxs, left, right = nodes[stack.pop()]
+            if self._box_distance(x, mins, maxs) > r:
+                continue
+            far = math.sqrt(sum(max(abs(v - lo), abs(v - hi)) ** 2 for v, lo, hi in zip(x, mins, maxs)))
+            if far <= r:
+                found.append(self.index[start:end])
+            elif left < 0:
+                d2 = ((self.points[start:end] - xa) ** 2).sum(axis=1)
+                found.append(self.index[start:end][d2 <= r * r])
+            else:
+                stack.extend((left, right))
+        return np.concatenate(found).tolist() if found else []
+
+
+class NearestIndex:
+    def __init__(self, backend=None):
+        self.backend = backend or ("scipy" if cKDTree is not None else "numpy")
+        self._snapshot = (None, np.empty(0, dtype=np.int64), None)  # (tree, mmsis, unit vectors)
+        self.stats = {"backend": self.backend, "builds": 0, "build_ms": None, "vessels": 0, "built_at": None}
+
+    def __len__(self):
+        return len(self._snapshot[1])
+
+    def build(self, mmsis, lats, lons):
+        """Build a tree over the given positions and swap it in."""
+        start = time.perf_counter()
+        points = to_unit_vectors(lats, lons)
+        if len(points) == 0:
+            tree = None
+        elif self.backend == "scipy":
+            tree = cKDTree(points, leafsize=LEAF_SIZE)
+        else:
+            tree = NumpyKDTree(points)
+        self._snapshot = (tree, np.asarray(mmsis), points)
+        self.stats["builds"] += 1
+        self.stats["build_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        self.stats["vessels"] = len(points)
+        self.stats["built_at"] = time.time()
+
+    def nearest(self, lat, lon, k=10, max_nm=None):
+        """[(mmsi, distance nm)] of the k nearest vessels, nearest first."""
+        tree, mmsis, _ = self._snapshot
+        if tree is None or k < 1:
+            return []
+        x = to_unit_vectors([lat], [lon])[0]
+        bound = nm_to_chord(max_nm) if max_nm is not None else math.inf
+        k = min(k, len(mmsis))
+        if self.backend == "scipy":
+            distances, indexes = tree.query(x, k=k, distance_upper_bound=bound)
+            pairs = [(d, i) for d, i in zip(np.atleast_1d(distances), np.atleast_1d(indexes)) if np.isfinite(d)]
+        else:
+            pairs = tree.query(x, k, bound)
+        return [(int(mmsis[i]), float(chord_to_nm(d))) for d, i in pairs]
+
+    def within(self, lat, lon, radius_nm):
+        """[(mmsi, distance nm)] of the vessels within `radius_nm`, nearest first."""
+        tree, mmsis, points = self._snapshot
+        if tree is None:
+            return []
+        x = to_unit_vectors([lat], [lon])[0]
+        indexes = np.asarray(tree.query_ball_point(x, nm_to_chord(radius_nm)), dtype=np.int64)
+        if len(indexes) == 0:
+            return []
+        distances = chord_to_nm(np.sqrt(((points[indexes] - x) ** 2).sum(axis=1)))
+        order = np.argsort(distances)
+        return list(zip(mmsis[indexes[order]].tolist(), distances[order].tolist()))
+
+    def get_stats(self):
+        return dict(self.stats)
+
+
+def _benchmark(count):
+    rng = np.random.default_rng(1)
+    # Vessels concentrated along a 10 x 10 degree coastal area, queries at vessel positions
+    lats = 32 + 10 * rng.random(count)
+    lons = -128 + 10 * rng.random(count)
+    mmsis = np.arange(count) + 200000000
+    queries = rng.integers(0, count, 2000)
+    backends = ["numpy"] + (["scipy"] if cKDTree is not None else [])
+    print(f"{count} vessels")
+    for backend in backends:
+        index = NearestIndex(backend)
+        index.build(mmsis, lats, lons)
+        print(f"  {backend:<6} build {index.stats['build_ms']:.1f} ms")
+        for name, run in (("nearest k=10", lambda i: index.nearest(lats[i], lons[i], 10)),
+                          ("within 5 nm", lambda i: index.within(lats[i], lons[i], 5.0))):
+            latencies = []
+            found = 0
+            for i in queries:
+                start = time.perf_counter()
+                found += len(run(i))
+                latencies.append(time.perf_counter() - start)
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+            print(f"    {name:<14} p50 {p50:.3f} ms  p99 {p99:.3f} ms  ({found / len(queries):.1f} results)")
+    # Brute force reference for the same queries
+    points = to_unit_vectors(lats, lons)
+    start = time.perf_counter()
+    for i in queries[:200]:
+        np.argpartition(((points - points[i]) ** 2).sum(axis=1), 10)[:10]
+    print(f"  brute force k=10: {(time.perf_counter() - start) / 200 * 1000:.3f} ms per query")
+    i = int(queries[0])
+    exact = sorted(great_circle_nm(lats[i], lons[i], la, lo) for la, lo in zip(lats, lons))[:10]
+    index = NearestIndex("numpy")
+    index.build(mmsis, lats, lons)
+    got = [d for _, d in index.nearest(lats[i], lons[i], 10)]
+    assert np.allclose(exact, got, atol=1e-6), (exact, got)
+
+
+if __name__ == "__main__":
+    import sys
+
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
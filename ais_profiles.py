@@ -0,0 +1,165 @@
+"""
+Rolling speed and heading profiles over a vessel's last N history rows.
+
+A RollingProfile keeps the window in a ring and running statistics that are
+updated as rows enter and leave it, so each update is O(1):
+
+- speed: count, mean and sum of squared deviations (Welford's update, with
+  its inverse for the row that leaves the window);
+- heading: sums of the unit vectors' sines and cosines, giving the circular
+  mean (correct across the 0/360 wrap) and the mean resultant length R,
+  reported as the circular standard deviation sqrt(-2 ln R).
+
+Rows without a valid value (non-position reports, SOG 102.3 "not available",
+heading 511) take a slot in the window but not in the statistics. The
+running sums are recomputed from the ring once per window of evictions, so
+rounding errors cannot build up.
+
+    python ais_profiles.py [reports]
+
+benchmarks updates against recomputing from the last rows with numpy.
+"""
+import math
+import time
+
+SPEED_MAX = 102.2  # knots; 102.3 means not available
+_EPSILON = 1e-12
+
+
+def valid_speed(sog):
+    return sog is not None and 0 <= sog < SPEED_MAX
+
+
+def valid_heading(heading):
+    return heading is not None and 0 <= heading < 360
+
+
+class RollingProfile:
+    __slots__ = ("window", "_speeds", "_headings", "_next", "_filled", "_evictions",
+                 "_n_speed", "_speed_mean", "_speed_m2", "_n_heading", "_sin", "_cos")
+
+    def __init__(self, window=100):
+        self.window = window
+        self._speeds = [None] * window
+        self._headings = [None] * window  # radians
+        self._next = 0  # ring slot of the next row
+        self._filled = 0
+        self._evictions = 0
+        self._n_speed = 0
+        self._speed_mean = 0.0
+        self._speed_m2 = 0.0
+        self._n_heading = 0
+        self._sin = 0.0
+        self._cos = 0.0
+
+    def add(self, sog=None, heading=None):
+        """Push a row's SOG (knots) and heading (degrees); None or out-of-range values are not counted."""
+        speed = sog if valid_speed(sog) else None
+        heading = math.radians(heading) if valid_heading(heading) else None
+        i = self._next
+        if self._filled == self.window:
+            self._remove(self._speeds[i], self._headings[i])
+            self._evictions += 1
+        else:
+            self._filled += 1
+        self._speeds[i] = speed
+        self._headings[i] = heading
+        self._next = i + 1 if i + 1 < self.window else 0
+        if speed is not None:
+            self._n_speed += 1
+            delta = speed - self._speed_mean
+            self._speed_mean += delta / self._n_speed
+            self._speed_m2 += delta * (speed - self._speed_mean)
+        if heading is not None:
+            self._n_heading += 1
+            self._sin += math.sin(heading)
+            self._cos += math.cos(heading)
+        if self._evictions >= self.window:
+            self._resync()
+
+    def _remove(self, speed, heading):
+        if speed is not None:
+            self._n_speed -= 1
+            if self._n_speed:
+                delta = speed - self._speed_mean
+                self._speed_mean -= delta / self._n_speed
+                self._speed_m2 -= delta * (speed - self._speed_mean)
+            else:
+                self._speed_mean = self._speed_m2 = 0.0
+        if heading is not None:
+            self._n_heading -= 1
+            self._sin -= math.sin(heading)
+            self._cos -= math.cos(heading)
+
+    def _resync(self):
+        speeds = [s for s in self._speeds if s is not None]
+        headings = [h for h in self._headings if h is not None]
+        self._n_speed = len(speeds)
+        self._speed_mean = sum(speeds) / len(speeds) if speeds else 0.0
+        self._speed_m2 = sum((s - self._speed_mean) ** 2 for s in speeds)
+        self._n_heading = len(headings)
+        self._sin = math.fsum(math.sin(h) for h in headings)
+        self._cos = math.fsum(math.cos(h) for h in headings)
+        self._evictions = 0
+
+    @property
+    def heading_resultant(self):
+        """Mean resultant length R in [0, 1] (1: all headings equal), or None without headings."""
+        if not self._n_heading:
+            return None
+        return min(1.0, math.hypot(self._sin, self._cos) / self._n_heading)
+
+    def to_dict(self):
+        """The profile as stored with history points: speed/heading mean and std (degrees), n speeds."""
+        profile = {}
+        if self._n_speed:
+            profile["speed_mean"] = self._speed_mean
+            profile["speed_std"] = math.sqrt(max(self._speed_m2, 0.0) / self._n_speed) if self._n_speed > 1 else 0.0
+        if self._n_heading:
+            profile["heading_mean"] = math.degrees(math.atan2(self._sin, self._cos)) % 360
+            # -2 ln R; below _EPSILON (constant headings) it is rounding noise in R
+            spread = -2 * math.log(max(self.heading_resultant, _EPSILON))
+            profile["heading_std"] = math.degrees(math.sqrt(spread)) if spread > _EPSILON else 0.0
+        profile["n"] = self._n_speed
+        return profile
+
+
+def _benchmark(count, window=100):
+    import numpy as np
+
+    rng = np.random.default_rng(1)
+    sogs = np.where(rng.random(count) < 0.05, 102.3, rng.normal(12, 1.5, count).clip(0)).tolist()
+    headings = ((rng.normal(0, 8, count)) % 360).tolist()  # around north, across the wrap
+    rows = np.empty(count, dtype=[("sog", "<f8"), ("heading", "<f8")])
+    rows["sog"], rows["heading"] = sogs, headings
+
+    start = time.perf_counter()
+    for i in range(1, count):
+        recent = rows[max(0, i - window):i]
+        speeds = recent["sog"][(recent["sog"] >= 0) & (recent["sog"] < SPEED_MAX)]
+        heads = recent["heading"][(recent["heading"] >= 0) & (recent["heading"] < 360)]
+        recomputed = {"speed_mean": float(speeds.mean()), "speed_std": float(speeds.std()),
+                      "heading_mean": float(heads.mean()), "heading_std": float(heads.std()), "n": len(speeds)}
+    numpy_us = (time.perf_counter() - start) / (count - 1) * 1e6
+
+    profile = RollingProfile(window)
+    start = time.perf_counter()
+    for sog, heading in zip(sogs, headings):
+        profile.add(sog, heading)
+        rolling = profile.to_dict()
+    rolling_us = (time.perf_counter() - start) / count * 1e6
+
+    last = rows[-window:]
+    speeds = last["sog"][last["sog"] < SPEED_MAX]
+    assert abs(rolling["speed_mean"] - speeds.mean()) < 1e-9 and abs(rolling["speed_std"] - speeds.std()) < 1e-9
+    print(f"{count} reports, window {window}")
+    print(f"  recompute from rows (numpy) {numpy_us:6.1f} us/report")
+    print(f"  rolling profile             {rolling_us:6.1f} us/report (add + to_dict)")
+    print(f"  heading around north: linear mean {recomputed['heading_mean']:.1f} (std {recomputed['heading_std']:.1f}), "
+          f"circular mean {rolling['heading_mean']:.1f} (std {rolling['heading_std']:.1f})")
+
+
+if __name__ == "__main__":
+    import sys
+
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
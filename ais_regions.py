@@ -0,0 +1,185 @@
+"""
+Regions tracked on the aisstream.io feed.
+
+AIS_REGIONS selects regions by name; "," separates upstream connections and
+"+" puts several regions on one connection (one subscription with several
+bounding boxes):
+
+    AIS_REGIONS=SF_BAY                              # default
+    AIS_REGIONS=SF_BAY,LA_LONG_BEACH,COLUMBIA_RIVER # three connections
+    AIS_REGIONS=SF_BAY+COLUMBIA_RIVER,LA_LONG_BEACH # two connections
+
+AIS_REGIONS_FILE may point to a JSON object {name: [[lat1, lon1], [lat2, lon2]]}
+adding or overriding regions. Boxes use the aisstream corner format.
+
+Connections whose boxes overlap deliver the same report more than once;
+OverlapDeduper drops the copies when the ingest stage drains its batch, before
+they are logged or processed.
+"""
+import os
+import re
+import time
+from collections import OrderedDict
+
+import ais_codec
+from ais_time import parse_time_utc
+
+# Format: [[lat1, lon1], [lat2, lon2]]
+REGIONS = {
+    "SF_BAY": [[38.2, -123.0], [37.2, -121.5]],
+    "LA_LONG_BEACH": [[34.1, -118.6], [33.3, -117.8]],
+    "COLUMBIA_RIVER": [[46.5, -124.3], [45.5, -122.6]],
+}
+DEFAULT_REGIONS = "SF_BAY"
+RATE_INTERVAL = 10.0  # seconds per throughput sample
+LAG_SMOOTHING = 0.05  # EWMA weight of the newest lag sample
+
+_MMSI_PATTERN = re.compile(rb'"MMSI"\s*:\s*(\d+)')
+_TYPE_PATTERN = re.compile(rb'"MessageType"\s*:\s*"(\w+)"')
+_TIME_PATTERN = re.compile(rb'"time_utc"\s*:\s*"([^"]+)"')
+_LAT_PATTERN = re.compile(rb'"latitude"\s*:\s*(-?[\d.]+)')
+_LON_PATTERN = re.compile(rb'"longitude"\s*:\s*(-?[\d.]+)')
+
+
+def load_regions(spec=None, path=None):
+    """Return connection groups as a list of [(name, bbox), ...] lists."""
+    spec = spec if spec is not None else os.getenv("AIS_REGIONS", DEFAULT_REGIONS)
+    path = path if path is not None else os.getenv("AIS_REGIONS_FILE")
+    regions = dict(REGIONS)
+    if path:
+        with open(path, "rb") as f:
+            regions.update(ais_codec.loads(f.read()))
+    groups = []
+    for group_spec in spec.split(","):
+        group = []
+        for name in group_spec.split("+"):
+            name = name.strip()
+            if not name:
+                continue
+            if name not in regions:
+                raise ValueError(f"Unknown AIS region: {name}")
+            group.append((name, regions[name]))
+        if group:
+            groups.append(group)
+    return groups
+
+
+def group_name(group):
+    return "+".join(name for name, _ in group)
+
+
+def bbox_contains(bbox, lat, lon):
+    (lat1, lon1), (lat2, lon2) = bbox
+    return min(lat1, lat2) <= lat <= max(lat1, lat2) and min(lon1, lon2) <= lon <= max(lon1, lon2)
+
+
+def build_subscription(api_key, group, filter_message_types=None):
+    subscription = {"APIKey": api_key, "BoundingBoxes": [bbox for _, bbox in group]}
+    if filter_message_types:
+        subscription["FilterMessageTypes"] = filter_message_types
+    return subscription
+
+
+def peek_frame(frame):
+    """(mmsi, message type, time_utc, lat, lon) of a raw frame without a full JSON parse."""
+    if isinstance(frame, str):
+        frame = frame.encode("utf-8")
+
+    def find(pattern):
+        match = pattern.search(frame)
+        return match.group(1) if match else None
+
+    mmsi, msg_type, time_utc, lat, lon = (find(p) for p in (_MMSI_PATTERN, _TYPE_PATTERN, _TIME_PATTERN, _LAT_PATTERN, _LON_PATTERN))
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        lat = lon = None
+    return (
+        int(mmsi) if mmsi else None,
+        msg_type.decode() if msg_type else None,
+        time_utc.decode() if time_utc else None,
+        lat,
+        lon,
+    )
+
+
+class OverlapDeduper:
+    """Remembers (MMSI, type, time_utc) keys for `window` seconds to drop copies from other connections."""
+
+    def __init__(self, window=30.0, max_keys=200000):
+        self.window = window
+        self.max_keys = max_keys
+        self._seen = OrderedDict()  # key -> (first seen, source)
+
+    def is_duplicate(self, key, source, now=None):
+        if key[0] is None or key[2] is None:
+            return False
+        now = now if now is not None else time.monotonic()
+        seen = self._seen
+        while seen:
+            first_seen = next(iter(seen.values()))[0]
+            if now - first_seen <= self.window and len(seen) < self.max_keys:
+                break
+            seen.popitem(last=False)
+        previous = seen.get(key)
+        if previous is not None:
+            # Reports repeated on the same connection are left to later stages
+            return previous[1] != source
+        seen[key] = (now, source)
+        return False
+
+
+class RegionStats:
+    def __init__(self, groups):
+        self.regions = {}
+        for group in groups:
+            for name, _ in group:
+                stats = self.regions.setdefault(name, {
+                    "connections": [],
+                    "messages": 0,
+                    "duplicates": 0,
+                    "messages_per_sec": 0.0,
+                    "lag_ms": None,
+                    "max_lag_ms": None,
+                })
+                stats["connections"].append(group_name(group))
+        self.connections = {group_name(g): {"connected": False, "reconnects": 0} for g in groups}
+        self._window = {name: [time.monotonic(), 0] for name in self.regions}
+
+    def record(self, region, time_utc=None, messages=1, duplicates=0):
+        """Count `messages` accepted and `duplicates` dropped for `region`; `time_utc` is a lag sample."""
+        stats = self.regions[region]
+        stats["duplicates"] += duplicates
+        if not messages:
+            return
+        stats["messages"] += messages
+        now = time.monotonic()
+        window = self._window[region]
+        window[1] += messages
+        if now - window[0] >= RATE_INTERVAL:
+            stats["messages_per_sec"] = round(window[1] / (now - window[0]), 1)
+            window[0], window[1] = now, 0
+        sent = parse_time_utc(time_utc)
+        if sent is not None:
+            lag = (time.time() - sent) * 1000
+            stats["lag_ms"] = lag if stats["lag_ms"] is None else stats["lag_ms"] + LAG_SMOOTHING * (lag - stats["lag_ms"])
+            stats["max_lag_ms"] = lag if stats["max_lag_ms"] is None else max(stats["max_lag_ms"], lag)
+
+    def get_stats(self):
+        regions = {}
+        for name, stats in self.regions.items():
+            stats = dict(stats)
+            for key in ("lag_ms", "max_lag_ms"):
+                if stats[key] is not None:
+                    stats[key] = round(stats[key], 1)
+            regions[name] = stats
+        return {"regions": regions, "connections": self.connections}
+
+
+def region_for(group, lat, lon):
+    """Name of the first region of `group` containing the position (the group's first region otherwise)."""
+    if lat is not None and len(group) > 1:
+        for name, bbox in group:
+            if bbox_contains(bbox, lat, lon):
+                return name
+    return group[0][0]
@@ -0,0 +1,285 @@
+"""
+Offline replay of recorded ais_stream.log segments.
+
+Frames are read from every closed segment (plain or gzip-compressed) and the
+active log, oldest first, and fed through the real processing path
+(dispatcher, process_position_report, detectors, broadcast) while preserving
+the original MetaData.time_utc pacing:
+
+    python ais_replay.py                  # 1x real time
+    python ais_replay.py --speed 60       # 60x faster than real time
+    python ais_replay.py --max            # as fast as processing allows
+
+At the end it prints throughput, processing latency percentiles and the
+alerts raised, so a day of traffic can be reprocessed after changing
+anomaly thresholds.
+
+The server's POST /replay runs an IsolatedReplay instead: the closed
+segments only, in a spawned process with its own state, so old frames never
+reach live vessels, alerts, the archive or the store.
+"""
+import argparse
+import asyncio
+import gzip
+import itertools
+import math
+import multiprocessing
+import os
+import queue
+import threading
+
+import ais_codec
+from ais_log_sink import list_segments
+from ais_time import parse_time_utc
+
+
+def iter_log_frames(path="ais_stream.log", active=True):
+    """Yield raw frames (bytes) from every segment of `path`, oldest first (without the active file if not `active`)."""
+    for segment in list_segments(path, active):
+        opener = gzip.open if segment.endswith(".gz") else open
+        try:
+            with opener(segment, "rb") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        yield line
+        except (OSError, EOFError) as e:
+            # A segment still being compressed or truncated by a crash
+            print(f"Skipping unreadable log segment {segment}: {e}")
+
+
+def iter_messages(frames, stats):
+    """Parse frames, yielding (epoch time or None, message dict)."""
+    for frame in frames:
+        try:
+            msg = ais_codec.loads(frame)
+        except Exception:
+            stats["parse_errors"] += 1
+            continue
+        if not isinstance(msg, dict):
+            stats["parse_errors"] += 1
+            continue
+        yield parse_time_utc(msg.get("MetaData", {}).get("time_utc")), msg
+
+
+# Latencies are counted in log-spaced buckets (each 5% wider than the previous, from 10 us to
+# about 20 min), so memory and GET /replay stay constant however many frames are replayed
+LATENCY_MIN = 1e-5  # seconds
+LATENCY_GROWTH = 1.05
+LATENCY_BUCKETS = 384
+_LOG_GROWTH = math.log(LATENCY_GROWTH)
+
+
+def new_replay_stats():
+    return {"frames": 0, "parse_errors": 0, "batches": 0, "started": 0.0, "elapsed": 0.0,
+            "latency_buckets": [0] * LATENCY_BUCKETS, "latency_count": 0, "latency_max": 0.0}
+
+
+def record_latency(stats, latency):
+    buckets = stats["latency_buckets"]
+    i = int(math.log(latency / LATENCY_MIN) / _LOG_GROWTH) + 1 if latency > LATENCY_MIN else 0
+    buckets[min(i, LATENCY_BUCKETS - 1)] += 1
+    stats["latency_count"] += 1
+    if latency > stats["latency_max"]:
+        stats["latency_max"] = latency
+
+
+def latency_percentile(stats, p):
+    """Upper bound of the bucket holding the p-th percentile latency (seconds), capped by the maximum seen."""
+    count = stats["latency_count"]
+    if not count:
+        return 0.0
+    rank = min(count - 1, int(p / 100 * count))
+    seen = 0
+    for i, n in enumerate(stats["latency_buckets"]):
+        seen += n
+        if seen > rank:
+            return min(LATENCY_MIN * LATENCY_GROWTH ** i, stats["latency_max"])
+    return stats["latency_max"]
+
+
+async def replay(messages, handle_batch, speed=1.0, batch_size=500, stats=None, stop_event=None):
+    """
+    Feed (time, msg) pairs to `handle_batch(list_of_msgs)` (a coroutine function).
+
+    speed=1.0 replays in real time, speed=N is N times faster, and speed=None
+    (or 0) runs at maximum throughput. Messages whose time_utc cannot be
+    parsed are delivered with the previous message. Latency is measured from
+    when a message became due to when its batch finished processing.
+    """
+    stats = stats if stats is not None else new_replay_stats()
+    loop = asyncio.get_running_loop()
+    wall_start = loop.time()
+    stats["started"] = wall_start
+    first_ts = None
+    batch, due = [], []
+
+    async def flush():
+        await handle_batch(batch)
+        # Let broadcasts and HTTP handlers run even during max-throughput replays
+        await asyncio.sleep(0)
+        done = loop.time()
+        for d in due:
+            record_latency(stats, done - d)
+        stats["frames"] += len(batch)
+        stats["batches"] += 1
+        batch.clear()
+        due.clear()
+
+    for ts, msg in messages:
+        if stop_event is not None and stop_event.is_set():
+            break
+        now = loop.time()
+        target = now
+        if speed and ts is not None:
+            if first_ts is None:
+                first_ts = ts
+            target = wall_start + max(0.0, ts - first_ts) / speed
+            if target > now:
+                if batch:
+                    await flush()
+                await asyncio.sleep(target - loop.time())
+        batch.append(msg)
+        due.append(target)
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+    stats["elapsed"] = loop.time() - wall_start
+    return stats
+
+
+def summarize(stats):
+    def pct(p):
+        return latency_percentile(stats, p) * 1000
+
+    elapsed = stats["elapsed"]
+    return {
+        "frames": stats["frames"],
+        "parse_errors": stats["parse_errors"],
+        "batches": stats["batches"],
+        "elapsed_s": round(elapsed, 3),
+        "messages_per_sec": round(stats["frames"] / elapsed, 1) if elapsed > 0 else None,
+        "latency_ms": {"p50": round(pct(50), 3), "p95": round(pct(95), 3), "p99": round(pct(99), 3),
+                       "max": round(stats["latency_max"] * 1000, 3)},
+    }
+
+
+def _replay_process(path, speed, batch_size, outbox, stop, interval=0.5):
+    # Fresh state that persists nothing: no archive, store, checkpoint or log sink (that is only opened on startup)
+    for name in ("AIS_ARCHIVE_DIR", "AIS_STORE_PATH", "AIS_CHECKPOINT_PATH"):
+        os.environ.pop(name, None)
+    os.environ["AIS_WORKERS"] = "0"
+    import ais_websocket_server as server
+
+    stats = new_replay_stats()
+
+    def status():
+        stats["elapsed"] = asyncio.get_running_loop().time() - stats["started"]
+        return {**summarize(stats), "vessels": len(server.vessels), "alerts": dict(server.alert_stats)}
+
+    async def run():
+        last = 0.0
+
+        async def handle_batch(batch):
+            nonlocal last
+            await server.dispatch_batch(batch)
+            if asyncio.get_running_loop().time() - last >= interval:
+                last = asyncio.get_running_loop().time()
+                outbox.put(status())
+
+        try:
+            await replay(iter_messages(iter_log_frames(path, active=False), stats), handle_batch,
+                         speed=speed, batch_size=batch_size, stats=stats, stop_event=stop)
+        except Exception as e:
+            print("Replay error:", e)
+        outbox.put(status())
+
+    try:
+        asyncio.run(run())
+    finally:
+        outbox.put(None)
+
+
+class IsolatedReplay:
+    """A replay of the closed segments of `path` in a spawned process; `status` is its latest summary."""
+
+    def __init__(self, path, speed=1.0, batch_size=500):
+        self.path = path
+        self.speed = speed
+        self.batch_size = batch_size
+        self.status = summarize(new_replay_stats())
+        self._ctx = multiprocessing.get_context("spawn")
+        self._stop = self._ctx.Event()
+        self._outbox = self._ctx.Queue()
+        self._process = None
+
+    def start(self):
+        self._process = self._ctx.Process(target=_replay_process, name="ais-replay", daemon=True,
+                                          args=(self.path, self.speed, self.batch_size, self._outbox, self._stop))
+        self._process.start()
+        threading.Thread(target=self._read_status, name="ais-replay-status", daemon=True).start()
+        return self
+
+    def _read_status(self):
+        while True:
+            try:
+                status = self._outbox.get(timeout=1.0)
+            except queue.Empty:
+                if self._process.is_alive():
+                    continue
+                return
+            if status is None:
+                return
+            self.status = status
+
+    def running(self):
+        return self._process is not None and self._process.is_alive()
+
+    def stop(self):
+        self._stop.set()
+
+
+async def _run_cli(args):
+    import ais_websocket_server as server
+
+    if server.AIS_WORKERS > 0:
+        server.start_worker_pool()
+    stats = new_replay_stats()
+    frames = iter_log_frames(args.log)
+    if args.limit:
+        frames = itertools.islice(frames, args.limit)
+    speed = None if args.max else args.speed
+    await replay(iter_messages(frames, stats), server.dispatch_batch, speed=speed, batch_size=args.batch_size, stats=stats)
+    if server.worker_pool is not None:
+        # With workers, batches are only handed off above; wait for the results
+        while server.worker_pool.outstanding():
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+        stats["elapsed"] = asyncio.get_running_loop().time() - stats["started"]
+    # Flush anything the server buffers (e.g. the open history archive segment)
+    server.shutdown_event()
+    summary = summarize(stats)
+    summary["vessels"] = len(server.vessels)
+    summary["alerts"] = server.alert_stats
+    if server.worker_pool is not None:
+        summary["workers"] = {i: {"batches": w["batches"], "messages": w["messages"]} for i, w in server.worker_pool.stats.items()}
+    else:
+        summary["dispatch"] = server.message_dispatcher.get_stats()
+        summary["dedup"] = server.message_deduper.get_stats() if server.message_deduper is not None else None
+    print(ais_codec.dumps(summary, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded ais_stream.log through the processing pipeline")
+    parser.add_argument("--log", default="ais_stream.log", help="active log path; rotated segments are found next to it")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor (1 = real time)")
+    parser.add_argument("--max", action="store_true", help="replay at maximum throughput, ignoring time_utc pacing")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=0, help="stop after this many frames")
+    args = parser.parse_args()
+    asyncio.run(_run_cli(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Trajectory simplification (Douglas-Peucker) with a tolerance in meters.
+
+Positions are projected to local equirectangular meters (longitudes are
+unwrapped first, so tracks crossing the antimeridian stay continuous). The
+recursion is run breadth-first: each pass measures every point of every
+open segment in one set of numpy operations, keeps the farthest point of
+each segment that is out of tolerance and splits it there, so the number of
+passes is the depth of the recursion rather than the number of segments.
+While only a few segments are open, they are measured one contiguous slice
+at a time instead, which avoids gathering the points.
+
+With `times`, distances are synchronized Euclidean distances (SED, the
+time-aware variant): a point is compared with where the vessel would have
+been at that time moving uniformly along the segment, so speed changes and
+stops are kept as well as turns.
+
+    python ais_simplify.py [points]
+
+benchmarks a noisy tug track (default 100k points).
+"""
+import time
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+LOOP_SEGMENTS = 64  # open segments measured one slice at a time; more are measured in one vectorized pass
+
+
+def project(lats, lons):
+    """(x, y) in meters, local equirectangular around the mean latitude."""
+    lats = np.asarray(lats, dtype=float)
+    lons = np.unwrap(np.asarray(lons, dtype=float), period=360)
+    lat_rad = np.radians(lats)
+    x = EARTH_RADIUS_M * np.radians(lons) * np.cos(lat_rad.mean())
+    y = EARTH_RADIUS_M * lat_rad
+    return x, y
+
+
+def _distance2(px, py, dx, dy, elapsed=None, duration=None):
+    """Squared distance of points (relative to a segment's start) from the segment (dx, dy).
+
+    Without times this is the distance to the closest point of the segment; with
+    `elapsed` and `duration` it is to the point reached at that time (SED).
+    """
+    if elapsed is None:
+        length2 = dx * dx + dy * dy
+        ratio = np.clip((px * dx + py * dy) / np.where(length2 > 0, length2, np.inf), 0.0, 1.0)
+    else:
+        ratio = elapsed / np.where(duration > 0, duration, np.inf)
+    px = px - ratio * dx
+    py = py - ratio * dy
+    return px * px + py * py
+
+
+def simplify(lats, lons, tolerance, times=None, keep=None):
+    """
+    Sorted indexes of the points kept: always the first and the last, and the
+    points where the boolean array `keep` is set (the track is split there).
+    """
+    n = len(lats)
+    if n <= 2:
+        return np.arange(n)
+    x, y = project(lats, lons)
+    t = None if times is None else np.asarray(times, dtype=float)
+    tolerance2 = float(tolerance) ** 2
+    keep = np.zeros(n, dtype=bool) if keep is None else np.array(keep, dtype=bool)
+    keep[0] = keep[-1] = True
+    breaks = np.flatnonzero(keep)
+    starts, ends = breaks[:-1], breaks[1:]
+    while True:
+        inner = ends - starts - 1
+        open_ = inner > 0
+        starts, ends, inner = starts[open_], ends[open_], inner[open_]
+        if not len(starts):
+            break
+        if len(starts) <= LOOP_SEGMENTS:
+            # Few segments: contiguous slices are cheaper than gathering every point
+            split, pivots = np.zeros(len(starts), dtype=bool), []
+            for i, (a, b) in enumerate(zip(starts.tolist(), ends.tolist())):
+                d2 = _distance2(x[a + 1:b] - x[a], y[a + 1:b] - y[a], x[b] - x[a], y[b] - y[a],
+                                None if t is None else t[a + 1:b] - t[a], None if t is None else t[b] - t[a])
+                j = int(d2.argmax())
+                if d2[j] > tolerance2:
+                    split[i] = True
+                    pivots.append(a + 1 + j)
+            pivots = np.array(pivots, dtype=starts.dtype)
+        else:
+            # Every point strictly inside an open segment, with the index of its segment
+            first = np.cumsum(inner) - inner
+            segment = np.repeat(np.arange(len(starts)), inner)
+            idx = np.arange(int(inner.sum())) + np.repeat(starts + 1 - first, inner)
+            x0, y0 = x[starts], y[starts]
+            dx, dy = (x[ends] - x0)[segment], (y[ends] - y0)[segment]
+            if t is None:
+                d2 = _distance2(x[idx] - x0[segment], y[idx] - y0[segment], dx, dy)
+            else:
+                d2 = _distance2(x[idx] - x0[segment], y[idx] - y0[segment], dx, dy,
+                                t[idx] - t[starts][segment], (t[ends] - t[starts])[segment])
+            farthest = np.maximum.reduceat(d2, first)
+            split = farthest > tolerance2
+            # First point reaching its segment's maximum, for the segments being split
+            at_max = np.flatnonzero((d2 == farthest[segment]) & split[segment])
+            _, first_at_max = np.unique(segment[at_max], return_index=True)
+            pivots = idx[at_max[first_at_max]]
+        if not len(pivots):
+            break
+        keep[pivots] = True
+        starts = np.concatenate((starts[split], pivots))
+        ends = np.concatenate((pivots, ends[split]))
+    return np.flatnonzero(keep)
+
+
+def simplify_track(lats, lons, tolerance, times=None, keep=None):
+    """simplify() for track rows where some have no position (NaN): those rows are always kept."""
+    lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+    positioned = ~(np.isnan(lats) | np.isnan(lons))
+    idx = np.flatnonzero(positioned)
+    selected = ~positioned
+    kept = simplify(lats[idx], lons[idx], tolerance,
+                    None if times is None else np.asarray(times)[idx], None if keep is None else keep[idx])
+    selected[idx[kept]] = True
+    return np.flatnonzero(selected)
+
+
+def _max_error(x, y, kept, t=None):
+    """Largest distance of a dropped point from the simplified track (for checking)."""
+    worst = 0.0
+    for a, b in zip(kept[:-1], kept[1:]):
+        if b - a < 2:
+            continue
+        idx = np.arange(a + 1, b)
+        dx, dy = x[b] - x[a], y[b] - y[a]
+        px, py = x[idx] - x[a], y[idx] - y[a]
+        if t is None:
+            ratio = np.clip((px * dx + py * dy) / max(dx * dx + dy * dy, 1e-12), 0, 1)
+        else:
+            ratio = (t[idx] - t[a]) / max(t[b] - t[a], 1e-12)
+        worst = max(worst, float(np.hypot(px - ratio * dx, py - ratio * dy).max()))
+    return worst
+
+
+def _simplify_per_segment(x, y, tolerance):
+    """Conventional Douglas-Peucker, one numpy call per segment (baseline for the benchmark)."""
+    keep = np.zeros(len(x), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(x) - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        dx, dy = x[b] - x[a], y[b] - y[a]
+        px, py = x[a + 1:b] - x[a], y[a + 1:b] - y[a]
+        ratio = np.clip((px * dx + py * dy) / max(dx * dx + dy * dy, 1e-12), 0, 1)
+        distance = np.hypot(px - ratio * dx, py - ratio * dy)
+        i = int(distance.argmax())
+        if distance[i] > tolerance:
+            keep[a + 1 + i] = True
+            stack += [(a, a + 1 + i), (a + 1 + i, b)]
+    return np.flatnonzero(keep)
+
+
+def _benchmark(count):
+    rng = np.random.default_rng(1)
+    # A tug reporting every 3 s: long straight legs with a few turns and stops, 3 m GPS noise
+    t = np.arange(count) * 3.0
+    headings = np.radians(np.repeat(rng.uniform(0, 360, count // 5000 + 1), 5000)[:count])
+    speeds = np.repeat(rng.choice([0.0, 4.0, 5.0, 6.0], count // 5000 + 1), 5000)[:count]  # m/s
+    x = np.cumsum(np.sin(headings) * speeds * 3.0) + rng.normal(0, 3, count)
+    y = np.cumsum(np.cos(headings) * speeds * 3.0) + rng.normal(0, 3, count)
+    lats = 37.8 + np.degrees(y / EARTH_RADIUS_M)
+    lons = -122.4 + np.degrees(x / (EARTH_RADIUS_M * np.cos(np.radians(37.8))))
+    px, py = project(lats, lons)
+    print(f"{count} points")
+    for tolerance in (10.0, 50.0):
+        for name, times in (("douglas-peucker", None), ("sed (time-aware)", t)):
+            runs = 5
+            start = time.perf_counter()
+            for _ in range(runs):
+                kept = simplify(lats, lons, tolerance, times)
+            ms = (time.perf_counter() - start) / runs * 1000
+            error = _max_error(px, py, kept, times)
+            assert error <= tolerance + 1e-6, error
+            print(f"  {tolerance:>4.0f} m {name:<17} {ms:7.1f} ms  kept {len(kept):>6} ({len(kept) / count:.1%}), "
+                  f"max error {error:.1f} m")
+        start = time.perf_counter()
+        baseline = _simplify_per_segment(px, py, tolerance)
+        ms = (time.perf_counter() - start) * 1000
+        assert len(baseline) == len(simplify(lats, lons, tolerance))
+        print(f"  {tolerance:>4.0f} m {'per-segment loop':<17} {ms:7.1f} ms  kept {len(baseline):>6}")
+
+
+if __name__ == "__main__":
+    import sys
+
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
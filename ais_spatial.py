@@ -0,0 +1,190 @@
+"""
+Uniform grid index over the latest vessel positions.
+
+Each vessel lives in exactly one `grid_size`-degree cell. update() is called
+on every position report and only touches the cell sets when the vessel
+crosses into another cell, so the common case is one dict update. Entries
+are kept in least-recently-updated order, which lets vessels that have not
+reported for `stale_after` seconds be evicted from the front without a scan.
+Evictions happen in update() and expire(), which run on the thread that owns
+the index (the event loop); query() only reads.
+
+A bounding-box query visits the cells it overlaps, or the occupied cells
+when that is fewer (e.g. a whole-world query), so its cost does not depend
+on how many vessels are outside the box.
+
+    python ais_spatial.py
+
+benchmarks updates and queries at 10k and 100k vessels against a full scan.
+"""
+import math
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class GridIndex:
+    def __init__(self, grid_size=0.1, stale_after=None, on_evict=None):
+        self.grid_size = grid_size  # degrees
+        self.stale_after = stale_after or None  # seconds; None keeps entries until removed
+        self.on_evict = on_evict  # called with the MMSI of each stale vessel evicted
+        self._cells = {}  # {(lat_idx, lon_idx): set of MMSIs}
+        self._entries = OrderedDict()  # {mmsi: [cell, lat, lon, last update]}, oldest update first
+        self.stats = {"updates": 0, "moves": 0, "evicted": 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, mmsi):
+        return mmsi in self._entries
+
+    def cell(self, lat, lon):
+        return (math.floor(lat / self.grid_size), math.floor(lon / self.grid_size))
+
+    def update(self, mmsi, lat, lon, now=None):
+        now = now if now is not None else time.monotonic()
+        self.stats["updates"] += 1
+        cell = self.cell(lat, lon)
+        entry = self._entries.get(mmsi)
+        if entry is None:
+            self._entries[mmsi] = [cell, lat, lon, now]
+            self._cells.setdefault(cell, set()).add(mmsi)
+        else:
+            if entry[0] != cell:
+                self._discard(entry[0], mmsi)
+                self._cells.setdefault(cell, set()).add(mmsi)
+                entry[0] = cell
+                self.stats["moves"] += 1
+            entry[1], entry[2], entry[3] = lat, lon, now
+            self._entries.move_to_end(mmsi)
+        self.expire(now)
+
+    def remove(self, mmsi):
+        entry = self._entries.pop(mmsi, None)
+        if entry is not None:
+            self._discard(entry[0], mmsi)
+
+    def expire(self, now=None):
+        """Evict vessels not updated within `stale_after` seconds; returns how many."""
+        if self.stale_after is None or not self._entries:
+            return 0
+        cutoff = (now if now is not None else time.monotonic()) - self.stale_after
+        entries = self._entries
+        n = 0
+        while entries:
+            mmsi, entry = next(iter(entries.items()))
+            if entry[3] >= cutoff:
+                break
+            entries.popitem(last=False)
+            self._discard(entry[0], mmsi)
+            if self.on_evict is not None:
+                self.on_evict(mmsi)
+            n += 1
+        self.stats["evicted"] += n
+        return n
+
+    def query(self, min_lat, max_lat, min_lon, max_lon):
+        """MMSIs whose latest position lies within the box (inclusive)."""
+        lat_lo, lon_lo = self.cell(min_lat, min_lon)
+        lat_hi, lon_hi = self.cell(max_lat, max_lon)
+        if lat_hi < lat_lo or lon_hi < lon_lo:
+            return []
+        cells = self._cells
+        if (lat_hi - lat_lo + 1) * (lon_hi - lon_lo + 1) <= len(cells):
+            candidates = ((lat_idx, lon_idx) for lat_idx in range(lat_lo, lat_hi + 1)
+                          for lon_idx in range(lon_lo, lon_hi + 1))
+        else:
+            candidates = [c for c in cells if lat_lo <= c[0] <= lat_hi and lon_lo <= c[1] <= lon_hi]
+        result = []
+        entries = self._entries
+        for cell in candidates:
+            members = cells.get(cell)
+            if not members:
+                continue
+            inner = lat_lo < cell[0] < lat_hi and lon_lo < cell[1] < lon_hi
+            for mmsi in members:
+                if inner:
+                    result.append(mmsi)
+                    continue
+                _, lat, lon, _ = entries[mmsi]
+                if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon:
+                    result.append(mmsi)
+        return result
+
+    def positions(self):
+        """Snapshot of (mmsis, lats, lons) arrays."""
+        entries = self._entries
+        n = len(entries)
+        mmsis = np.fromiter(entries.keys(), dtype=np.int64, count=n)
+        lats = np.fromiter((e[1] for e in entries.values()), dtype=float, count=n)
+        lons = np.fromiter((e[2] for e in entries.values()), dtype=float, count=n)
+        return mmsis, lats, lons
+
+    def clear(self):
+        self._cells.clear()
+        self._entries.clear()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["vessels"] = len(self._entries)
+        stats["cells"] = len(self._cells)
+        stats["grid_size"] = self.grid_size
+        stats["stale_after"] = self.stale_after
+        return stats
+
+    def _discard(self, cell, mmsi):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(mmsi)
+            if not members:
+                del self._cells[cell]
+
+
+def _benchmark():
+    import random
+
+    rng = random.Random(1)
+    # Vessels spread over a 4 x 6 degree coastal area, queries of harbour, bay and whole-world size
+    boxes = {"0.2 deg box": 0.2, "1 deg box": 1.0, "world": None}
+    print(f"{'vessels':>8}{'update us':>11}{'moves %':>9}" + "".join(f"{name:>26}" for name in boxes))
+    for count in (10000, 100000):
+        index = GridIndex(0.1)
+        positions = {}
+        for mmsi in range(count):
+            lat, lon = 36 + 4 * rng.random(), -124 + 6 * rng.random()
+            positions[mmsi] = (lat, lon)
+            index.update(mmsi, lat, lon)
+        moves_before = index.stats["moves"]
+        updates = [(rng.randrange(count), rng.gauss(0, 0.002), rng.gauss(0, 0.002)) for _ in range(200000)]
+        start = time.perf_counter()
+        for mmsi, dlat, dlon in updates:
+            lat, lon = positions[mmsi]
+            lat, lon = lat + dlat, lon + dlon
+            positions[mmsi] = (lat, lon)
+            index.update(mmsi, lat, lon)
+        update_us = (time.perf_counter() - start) / len(updates) * 1e6
+        moves = (index.stats["moves"] - moves_before) / len(updates) * 100
+        row = f"{count:>8}{update_us:>11.2f}{moves:>9.1f}"
+        for size in boxes.values():
+            if size is None:
+                box = (-90, 90, -180, 180)
+            else:
+                lat, lon = 37.5, -122.5
+                box = (lat, lat + size, lon, lon + size)
+            runs = 20
+            start = time.perf_counter()
+            for _ in range(runs):
+                found = index.query(*box)
+            index_ms = (time.perf_counter() - start) / runs * 1000
+            start = time.perf_counter()
+            scanned = [m for m, (lat, lon) in positions.items()
+                       if box[0] <= lat <= box[1] and box[2] <= lon <= box[3]]
+            scan_ms = (time.perf_counter() - start) * 1000
+            assert sorted(found) == sorted(scanned)
+            row += f"{len(found):>8} in {index_ms:7.3f} ms (scan {scan_ms:5.1f})"
+        print(row)
+
+
+if __name__ == "__main__":
+    _benchmark()
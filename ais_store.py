@@ -0,0 +1,287 @@
+"""
+SQLite store for position history and alerts.
+
+Points and alerts are queued by the event loop and written by one writer
+thread, which commits them in groups (every `batch_records` rows or
+`batch_ms` milliseconds, one transaction each), so ingest never waits on the
+disk. The database runs in WAL mode: readers use their own connection per
+thread and never block the writer or each other.
+
+    points(mmsi, time, lat, lon, sog, cog, heading, nav_status, msg_type, cell)
+        indexed on (mmsi, time) for /history and on (time, cell) for
+        time-bounded area scans, where cell is a CELL_DEGREES grid cell
+    alerts(mmsi, time, type, lat, lon, alert)
+        alert is the alert dict as JSON; indexed on (mmsi, time) and (time)
+
+Rows still queued for the writer are not visible to readers yet (at most
+`batch_ms` behind).
+
+    python ais_store.py [points]
+
+measures insert throughput and query latency on a synthetic fleet.
+"""
+import json
+import math
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from history_archive import MESSAGE_TYPE_CODES, NAV_STATUS_NA, POINT_DTYPE
+
+CELL_DEGREES = 1.0
+_CELL_COLUMNS = int(360 / CELL_DEGREES)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS points (
+    mmsi INTEGER NOT NULL, time REAL NOT NULL, lat REAL NOT NULL, lon REAL NOT NULL,
+    sog REAL, cog REAL, heading REAL, nav_status INTEGER, msg_type INTEGER, cell INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS points_mmsi_time ON points (mmsi, time);
+CREATE INDEX IF NOT EXISTS points_time_cell ON points (time, cell);
+CREATE TABLE IF NOT EXISTS alerts (
+    mmsi INTEGER NOT NULL, time REAL NOT NULL, type TEXT NOT NULL, lat REAL, lon REAL, alert TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS alerts_mmsi_time ON alerts (mmsi, time);
+CREATE INDEX IF NOT EXISTS alerts_time ON alerts (time);
+"""
+
+# Missing sog/cog/heading are read back as -1 and turned into NaN, like the archive's NA codes
+_POINT_COLUMNS = ("mmsi, time, lat, lon, IFNULL(sog, -1), IFNULL(cog, -1), IFNULL(heading, -1), "
+                  f"IFNULL(nav_status, {NAV_STATUS_NA}), IFNULL(msg_type, 0)")
+
+_POINT, _ALERT = 0, 1
+
+
+def cell(lat, lon):
+    return (math.floor(lat / CELL_DEGREES) + int(90 / CELL_DEGREES)) * _CELL_COLUMNS + \
+        math.floor(lon / CELL_DEGREES) + int(180 / CELL_DEGREES)
+
+
+def cells_in_box(min_lat, max_lat, min_lon, max_lon):
+    lo, hi = cell(min_lat, min_lon), cell(max_lat, max_lon)
+    lon_lo, lon_hi = lo % _CELL_COLUMNS, hi % _CELL_COLUMNS
+    return [row * _CELL_COLUMNS + col for row in range(lo // _CELL_COLUMNS, hi // _CELL_COLUMNS + 1)
+            for col in range(lon_lo, lon_hi + 1)]
+
+
+def _number(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value == value else None
+
+
+def _to_points(rows):
+    points = np.array(rows, dtype=POINT_DTYPE) if rows else np.empty(0, dtype=POINT_DTYPE)
+    for name in ("sog", "cog", "heading"):
+        points[name][points[name] < 0] = np.nan
+    return points
+
+
+class HistoryStore:
+    def __init__(self, path, batch_records=10000, batch_ms=200, max_pending=100000):
+        self.path = path
+        self.batch_records = batch_records
+        self.batch_ms = batch_ms
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")  # durable at checkpoints; a crash loses at most the last commits
+        self._db.execute("PRAGMA cache_size=-65536")  # KiB; keeps the hot index pages of random-MMSI inserts cached
+        self._db.executescript(SCHEMA)
+        self._thread = None
+        self.stats = {"points": 0, "alerts": 0, "dropped": 0, "commits": 0, "commit_ms": None, "errors": 0}
+
+    # --- Producer side (event loop) ---
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="history-store", daemon=True)
+            self._thread.start()
+        return self
+
+    def append(self, mmsi, epoch, lat, lon, sog=None, cog=None, heading=None, nav_status=None, message_type="PositionReport"):
+        self._put((_POINT, mmsi, epoch, lat, lon, sog, cog, heading, nav_status, message_type))
+
+    def append_alert(self, mmsi, epoch, alert):
+        self._put((_ALERT, mmsi, epoch, alert))
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def close(self):
+        """Commit everything still queued and stop the writer thread."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        with self._readers_lock:
+            for db in self._readers:
+                db.close()
+            self._readers.clear()
+        self._db.close()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["pending"] = self._queue.qsize()
+        return stats
+
+    # --- Writer thread ---
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_ms / 1000
+            while len(batch) < self.batch_records and batch[-1] is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            items = batch[:-1] if stop else batch
+            if items:
+                self._commit(items)
+            if stop:
+                return
+
+    def _commit(self, items):
+        points, alerts = [], []
+        for item in items:
+            if item[0] == _POINT:
+                _, mmsi, epoch, lat, lon, sog, cog, heading, nav_status, message_type = item
+                try:
+                    mmsi, lat, lon = int(mmsi), float(lat), float(lon)
+                except (TypeError, ValueError):
+                    self.stats["dropped"] += 1
+                    continue
+                points.append((mmsi, epoch, lat, lon, _number(sog), _number(cog), _number(heading),
+                               nav_status if isinstance(nav_status, int) else None,
+                               MESSAGE_TYPE_CODES.get(message_type, 0), cell(lat, lon)))
+            else:
+                _, mmsi, epoch, alert = item
+                alerts.append((int(mmsi), epoch, alert.get("type") or "unknown", _number(alert.get("lat")),
+                               _number(alert.get("lon")), json.dumps(alert, default=str)))
+        start = time.perf_counter()
+        try:
+            self._db.execute("BEGIN")
+            self._db.executemany("INSERT INTO points VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", points)
+            self._db.executemany("INSERT INTO alerts VALUES (?, ?, ?, ?, ?, ?)", alerts)
+            self._db.execute("COMMIT")
+        except sqlite3.Error as e:
+            if self._db.in_transaction:
+                self._db.execute("ROLLBACK")
+            self.stats["errors"] += 1
+            print("History store write error:", e)
+            return
+        self.stats["points"] += len(points)
+        self.stats["alerts"] += len(alerts)
+        self.stats["commits"] += 1
+        self.stats["commit_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+    # --- Reading (any thread) ---
+    def _reader(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            with self._readers_lock:
+                self._readers.append(db)
+        return db
+
+    def read(self, mmsi, since=None, until=None, limit=None):
+        """Stored points for `mmsi` as POINT_DTYPE rows, oldest first (at most `limit`)."""
+        sql = f"SELECT {_POINT_COLUMNS} FROM points WHERE mmsi = ? AND time >= ? AND time <= ? ORDER BY time, rowid"
+        args = [int(mmsi), -math.inf if since is None else since, math.inf if until is None else until]
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(int(limit))
+        return _to_points(self._reader().execute(sql, args).fetchall())
+
+    def read_box(self, min_lat, max_lat, min_lon, max_lon, since, until):
+        """Points of every vessel inside the box within [since, until], oldest first."""
+        cells = cells_in_box(min_lat, max_lat, min_lon, max_lon)
+        sql = (f"SELECT {_POINT_COLUMNS} FROM points WHERE time >= ? AND time <= ? "
+               f"AND cell IN ({','.join('?' * len(cells))}) "
+               "AND lat BETWEEN ? AND ? AND lon BETWEEN ? AND ? ORDER BY time, rowid")
+        rows = self._reader().execute(sql, [since, until, *cells, min_lat, max_lat, min_lon, max_lon]).fetchall()
+        return _to_points(rows)
+
+    def alerts(self, mmsi=None, alert_type=None, since=None, until=None, limit=1000):
+        """Stored alert dicts (with `mmsi`), newest first."""
+        sql = "SELECT mmsi, alert FROM alerts WHERE time >= ? AND time <= ?"
+        args = [-math.inf if since is None else since, math.inf if until is None else until]
+        if mmsi is not None:
+            sql += " AND mmsi = ?"
+            args.append(int(mmsi))
+        if alert_type is not None:
+            sql += " AND type = ?"
+            args.append(alert_type)
+        sql += " ORDER BY time DESC LIMIT ?"
+        args.append(int(limit))
+        return [{"mmsi": m, **json.loads(alert)} for m, alert in self._reader().execute(sql, args)]
+
+
+def _benchmark(count):
+    import tempfile
+
+    rng = np.random.default_rng(1)
+    vessels = 2000
+    with tempfile.TemporaryDirectory() as tmp:
+        store = HistoryStore(os.path.join(tmp, "history.db")).start()
+        mmsis = rng.integers(0, vessels, count) + 200000000
+        lats = 36 + 4 * rng.random(count)
+        lons = -124 + 6 * rng.random(count)
+        t0 = 1.7e9
+        enqueue_s = 0.0
+        start = time.perf_counter()
+        for i, (mmsi, lat, lon) in enumerate(zip(mmsis.tolist(), lats.tolist(), lons.tolist())):
+            if i % 10000 == 0:
+                # Stay below the queue bound: this measures the writer, not the drop policy
+                while store._queue.qsize() > 50000:
+                    time.sleep(0.01)
+            t = time.perf_counter()
+            store.append(mmsi, t0 + i * 0.01, lat, lon, sog=12.3, cog=90.0, heading=91, nav_status=0)
+            if i % 1000 == 0:
+                store.append_alert(mmsi, t0 + i * 0.01, {"type": "speed_anomaly", "lat": lat, "lon": lon})
+            enqueue_s += time.perf_counter() - t
+        store.close()
+        total_s = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp))
+        stats = store.stats
+        print(f"{stats['points']} points: enqueue {enqueue_s / count * 1e6:.2f} us/point, "
+              f"written at {stats['points'] / total_s:,.0f} points/s in {stats['commits']} commits "
+              f"({stats['dropped']} dropped), {size / 1e6:.1f} MB")
+        store = HistoryStore(os.path.join(tmp, "history.db"))
+        queries = {
+            "vessel, all": lambda m: store.read(m),
+            "vessel, 1 h": lambda m: store.read(m, t0 + count * 0.005, t0 + count * 0.005 + 3600),
+            "vessel, page 100": lambda m: store.read(m, limit=100),
+            "box 0.5 deg, 10 min": lambda m: store.read_box(38, 38.5, -122, -121.5, t0, t0 + 600),
+            "alerts, vessel": lambda m: store.alerts(mmsi=m),
+        }
+        for name, run in queries.items():
+            latencies, found = [], 0
+            for mmsi in mmsis[:200].tolist():
+                start = time.perf_counter()
+                found += len(run(mmsi))
+                latencies.append(time.perf_counter() - start)
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+            print(f"  {name:<20} p50 {p50:.2f} ms  p99 {p99:.2f} ms  ({found / 200:.0f} rows)")
+        store.close()
+
+
+if __name__ == "__main__":
+    import sys
+
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -3,6 +3,7 @@ import asyncio
 import json
 from dotenv import load_dotenv
 import websockets
+from ais_regions import load_regions, group_name, build_subscription
 
 # Load environment variables from .env file
 dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
@@ -11,23 +12,22 @@ API_KEY = os.getenv("AIS_STREAM_KEY")
 print("Loaded API_KEY:", API_KEY)
 assert API_KEY, "API_KEY not loaded from .env"
 
-# Bounding box for the larger San Francisco Bay Area
-# Format: [[lat1, lon1], [lat2, lon2]]
-BBOX_SF_BAY = [[38.2, -123.0], [37.2, -121.5]]
+# Regions to stream (SF Bay Area by default); see ais_regions.py for AIS_REGIONS
+AIS_REGION_GROUPS = load_regions()
 
 WS_URL = "wss://stream.aisstream.io/v0/stream"
 
-async def stream_ais():
-    subscription_msg = {
-        "APIKey": API_KEY,
-        "BoundingBoxes": [BBOX_SF_BAY]
-    }
+async def stream_region_group(group):
+    subscription_msg = build_subscription(API_KEY, group)
     async with websockets.connect(WS_URL) as ws:
         # Send subscription message within 3 seconds
         await ws.send(json.dumps(subscription_msg))
-        print("Subscribed to AIS stream for SF Bay Area.")
+        print(f"Subscribed to AIS stream for {group_name(group)}.")
         async for message in ws:
             print(message)
 
+async def stream_ais():
+    await asyncio.gather(*(stream_region_group(group) for group in AIS_REGION_GROUPS))
+
 if __name__ == "__main__":
     asyncio.run(stream_ais())
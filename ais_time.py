@@ -0,0 +1,53 @@
+import calendar
+
+# Epoch seconds at midnight UTC, keyed by "YYYY-MM-DD"
+_day_epochs = {}
+
+
+def parse_time_utc(value):
+    """
+    Convert an AIS timestamp to epoch seconds (float), or None if unparseable.
+
+    Accepts aisstream's MetaData.time_utc ("2025-05-01 12:00:00.123456789 +0000 UTC"),
+    ISO 8601 strings as produced by datetime.isoformat() (naive values are UTC),
+    and numbers, which are returned unchanged.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        day = value[:10]
+        base = _day_epochs.get(day)
+        if base is None:
+            if value[4] != "-" or value[7] != "-":
+                return None
+            base = calendar.timegm((int(value[0:4]), int(value[5:7]), int(value[8:10]), 0, 0, 0))
+            if len(_day_epochs) > 4096:
+                _day_epochs.clear()
+            _day_epochs[day] = base
+        if value[10] not in "T " or value[13] != ":":
+            return None
+        seconds = base + int(value[11:13]) * 3600 + int(value[14:16]) * 60
+        pos = 16
+        if len(value) > 16 and value[16] == ":":
+            seconds += int(value[17:19])
+            pos = 19
+        n = len(value)
+        if pos < n and value[pos] == ".":
+            end = pos + 1
+            while end < n and value[end].isdigit():
+                end += 1
+            digits = value[pos + 1:end]
+            if digits:
+                seconds += int(digits[:9]) / 10 ** len(digits[:9])
+            pos = end
+        rest = value[pos:].strip()
+        if rest and rest[0] in "+-":
+            sign = 1 if rest[0] == "+" else -1
+            offset = rest[1:].split(" ", 1)[0].replace(":", "")
+            if len(offset) >= 4 and offset[:4].isdigit():
+                seconds -= sign * (int(offset[:2]) * 3600 + int(offset[2:4]) * 60)
+        return float(seconds)
+    except (ValueError, IndexError, TypeError):
+        return None
@@ -0,0 +1,162 @@
+"""
+Process pool that shards AIS message processing by MMSI.
+
+Each worker process imports ais_websocket_server and runs the normal
+processing path (dispatcher, process_position_report, detectors) on the
+messages routed to it. Routing by MMSI keeps every vessel's history and
+profiles local to one worker. Workers send back one result per history
+record:
+
+    (mmsi, history record, epoch, latest vessel state, static fields, broadcast?)
+
+where the static fields are the registry entry set by the record's message
+(static data reports), else None. The record is pickled whole (normalized
+fields plus the raw report and MetaData tuples), since the broadcaster serves
+/history and broadcasts from it. The broadcaster process appends the records
+to its tracks, the archive and the store, registers the static fields (for
+ship types in its indexes and for checkpoints) and updates its position
+indexes. It keeps no detector state (rolling profiles, circle windows), so its
+share of the per-message work is about a quarter of inline processing. It then
+forwards the broadcastable points to WebSocket clients.
+"""
+import asyncio
+import multiprocessing
+import os
+import re
+import threading
+
+_MMSI_PATTERN = re.compile(rb'"MMSI"\s*:\s*(\d+)')
+
+
+def peek_mmsi(item):
+    """MMSI of a queued item (raw frame or message dict) without a full JSON parse."""
+    if isinstance(item, dict):
+        meta = item.get("MetaData", {})
+        mmsi = meta.get("MMSI") or meta.get("MMSI_String")
+        try:
+            return int(mmsi)
+        except (TypeError, ValueError):
+            return None
+    if isinstance(item, str):
+        item = item.encode("utf-8")
+    match = _MMSI_PATTERN.search(item)
+    return int(match.group(1)) if match else None
+
+
+def shard_for(mmsi, workers):
+    return mmsi % workers if mmsi is not None else 0
+
+
+def worker_main(index, workers, inbox, outbox):
+    # Archiving, the SQLite store and further sharding stay in the broadcaster process
+    os.environ.pop("AIS_ARCHIVE_DIR", None)
+    os.environ.pop("AIS_STORE_PATH", None)
+    os.environ["AIS_WORKERS"] = "0"
+    import ais_websocket_server as server
+
+    server.warm_start(keep=lambda mmsi: shard_for(mmsi, workers) == index)
+    appended = []
+    static = {}  # registry entries set since the vessel's last record
+    server.on_static_register = static.__setitem__
+    server.on_history_append = lambda mmsi, record, epoch: appended.append((mmsi, record, epoch, static.pop(mmsi, None)))
+    while True:
+        batch = inbox.get()
+        if batch is None:
+            break
+        try:
+            broadcast = {id(record) for record in server.process_ais_batch(batch)}
+        except Exception as e:
+            print(f"Worker {index} error processing batch:", e)
+            broadcast = set()
+        results = [
+            (mmsi, record, epoch, server.vessels.get(mmsi), fields, id(record) in broadcast)
+            for mmsi, record, epoch, fields in appended
+        ]
+        appended.clear()
+        server.expiry_sweeper.sweep_if_due()
+        dedup_stats = server.message_deduper.get_stats() if server.message_deduper is not None else None
+        outbox.put((index, len(batch), results, server.message_dispatcher.get_stats(), dedup_stats))
+
+
+class WorkerPool:
+    def __init__(self, workers, max_outstanding=8):
+        self.workers = workers
+        self.max_outstanding = max_outstanding  # batches in flight per worker
+        self._ctx = multiprocessing.get_context("spawn")
+        self._inboxes = []
+        self._outbox = None
+        self._processes = []
+        self._reader = None
+        self._results = None
+        self._loop = None
+        self._outstanding = [0] * workers
+        self._idle = None
+        self.stats = {i: {"batches": 0, "messages": 0, "dispatch": {}, "dedup": None} for i in range(workers)}
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._results = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._outbox = self._ctx.Queue()
+        for i in range(self.workers):
+            inbox = self._ctx.Queue()
+            process = self._ctx.Process(target=worker_main, args=(i, self.workers, inbox, self._outbox), name=f"ais-worker-{i}", daemon=True)
+            process.start()
+            self._inboxes.append(inbox)
+            self._processes.append(process)
+        self._reader = threading.Thread(target=self._read_results, name="ais-worker-results", daemon=True)
+        self._reader.start()
+        return self
+
+    def _read_results(self):
+        while True:
+            item = self._outbox.get()
+            self._loop.call_soon_threadsafe(self._results.put_nowait, item)
+            if item is None:
+                break
+
+    async def submit(self, batch):
+        """Route a batch to workers by MMSI, waiting while any target worker is saturated."""
+        shards = {}
+        for item in batch:
+            shards.setdefault(shard_for(peek_mmsi(item), self.workers), []).append(item)
+        for index in shards:
+            while self._outstanding[index] >= self.max_outstanding:
+                self._idle.clear()
+                await self._idle.wait()
+        for index, items in shards.items():
+            self._outstanding[index] += 1
+            self._inboxes[index].put(items)
+
+    async def results(self):
+        """Yield (results, ...) batches as workers finish them."""
+        while True:
+            item = await self._results.get()
+            if item is None:
+                return
+            index, count, results, dispatch_stats, dedup_stats = item
+            self._outstanding[index] -= 1
+            stats = self.stats[index]
+            stats["batches"] += 1
+            stats["messages"] += count
+            stats["dispatch"] = dispatch_stats
+            stats["dedup"] = dedup_stats
+            self._idle.set()
+            yield results
+
+    def outstanding(self):
+        return sum(self._outstanding)
+
+    def stop(self):
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for inbox in self._inboxes:
+            # Batches a stopped worker never read would otherwise block interpreter exit
+            inbox.cancel_join_thread()
+        if self._outbox is not None:
+            self._outbox.put(None)
@@ -1,7 +1,8 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, Body, Query
 import asyncio
 import os
-import json
+import ais_codec
+from ais_regions import load_regions, group_name, build_subscription, peek_frame, OverlapDeduper
 from dotenv import load_dotenv
 import websockets
 import sys
@@ -42,7 +43,7 @@ logger = logging.getLogger(__name__)
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), ".env"))
 API_KEY = os.getenv("AIS_STREAM_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-BBOX_SF_BAY = [[38.2, -123.0], [37.2, -121.5]]
+AIS_REGION_GROUPS = load_regions()  # one upstream connection per group, see ais_regions.py
 WS_URL = "wss://stream.aisstream.io/v0/stream"
 
 DEBUG_FIRST_ONLY = "--debug-first" in sys.argv
@@ -82,40 +83,45 @@ ais_message_queue = None
 vessel_data_cache = {}
 
 # AIS Stream Handling
-async def ais_stream_task():
-    """Connect to AIS stream and forward data to clients"""
-    subscription_msg = {
-        "APIKey": API_KEY,
-        "BoundingBoxes": [BBOX_SF_BAY]
-    }
+region_deduper = OverlapDeduper()
+
+async def ais_stream_task(group):
+    """Connect to AIS stream for one region group and forward data to clients"""
+    name = group_name(group)
+    subscription_msg = build_subscription(API_KEY, group)
     
     retry_delay = 5  # Initial retry delay in seconds
     max_retry_delay = 60  # Maximum retry delay in seconds
     
     while True:
         try:
-            logger.info("Connecting to AIS stream...")
+            logger.info(f"Connecting to AIS stream for {name}...")
             async with websockets.connect(WS_URL) as ws:
-                subscription_json = json.dumps(subscription_msg)
+                subscription_json = ais_codec.dumps(subscription_msg)
                 logger.info(f"Sending subscription: {subscription_json}")
                 await ws.send(subscription_json)
-                logger.info("Subscribed to AIS stream for SF Bay Area")
+                logger.info(f"Subscribed to AIS stream for {name}")
                 
                 # Reset retry delay on successful connection
                 retry_delay = 5
                 
                 message_count = 0
                 async for message in ws:
+                    if len(AIS_REGION_GROUPS) > 1:
+                        mmsi, msg_type, time_utc, _, _ = peek_frame(message)
+                        if region_deduper.is_duplicate((mmsi, msg_type, time_utc), name):
+                            continue
                     message_count += 1
                     if message_count % 10 == 0:
                         logger.info(f"Received {message_count} messages so far")
                     
                     # Parse message and then stringify in a consistent way
                     try:
-                        data = json.loads(message)
+                        data = ais_codec.loads(message)
                         logger.debug(f"Received AIS message type: {list(data.keys())}")
                     except Exception as e:
                         logger.error(f"Failed to parse message: {e}")
+                        continue
                     
                     # Process message through existing pipeline
                     await process_ais_message(data)
@@ -172,7 +178,7 @@ async def ais_stream_task():
                             logger.info(f"Found AIS data for MMSI: {mmsi}")
                         
                         # Convert data to a consistent JSON string format
-                        json_str = json.dumps(data)
+                        json_str = ais_codec.dumps(data)
                         logger.debug(f"Forwarding to {len(clients)} clients")
                         try:
                             await asyncio.gather(
@@ -225,7 +231,7 @@ async def chat_endpoint(request: Request):
         
         # Get request data
         data = await request.json()
-        logger.info(f"Request data: {json.dumps(data)[:200]}...")
+        logger.info(f"Request data: {ais_codec.dumps(data)[:200]}...")
         
         if not data or "query" not in data:
             logger.error("Invalid request: missing query")
@@ -277,11 +283,11 @@ async def call_openai_api(query, vessel_context, map_bounds):
 You are an AIS Map Assistant, helping users interact with real-time maritime vessel data.
 The user is viewing a map of the San Francisco Bay Area.
 
-Current map boundaries: {json.dumps(map_bounds)}
+Current map boundaries: {ais_codec.dumps(map_bounds)}
 
 There are {len(vessel_context)} visible vessels on the map currently.
 Here's data about some of these vessels:
-{json.dumps(vessel_context[:10], indent=2)}
+{ais_codec.dumps(vessel_context[:10], indent=2)}
 
 Respond to the user's query about the AIS data. If relevant, you can recommend actions like:
 - Focusing on specific vessels (providing their MMSI)
@@ -329,7 +335,7 @@ Keep responses concise, informative, and helpful.
                 # Check if the response contains a JSON block with actions
                 if "```json" in text_response and "```" in text_response:
                     json_block = text_response.split("```json")[1].split("```")[0].strip()
-                    action_data = json.loads(json_block)
+                    action_data = ais_codec.loads(json_block)
                     if isinstance(action_data, dict) and "actions" in action_data:
                         actions = action_data["actions"]
                         # Remove the JSON block from the text response
@@ -364,8 +370,9 @@ async def startup_event():
     else:
         logger.error("No AIS_STREAM_KEY found in .env file!")
     
-    # Start the AIS data forwarding task
-    ais_task = asyncio.create_task(ais_stream_task())
+    # Start one AIS data forwarding task per region group
+    for group in AIS_REGION_GROUPS:
+        asyncio.create_task(ais_stream_task(group))
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,359 @@
+"""
+Append-only on-disk archive of position history.
+
+Points are buffered in memory for the open segment and sealed when message
+time crosses a segment boundary (SEGMENT_SECONDS). Sealing sorts the rows by
+(mmsi, time), delta-encodes time/lat/lon within each vessel's run and writes
+one directory per segment:
+
+    <dir>/<segment start UTC>/rows.npy    ROW_DTYPE, one run per vessel
+    <dir>/<segment start UTC>/index.npy   INDEX_DTYPE, sorted by mmsi
+    <dir>/<segment start UTC>/base.npy    segment start, epoch milliseconds
+
+Sealed segments are memory-mapped, so reading a vessel's run is a zero-copy
+slice followed by a cumulative sum over just that run. The open segment (and
+any segment still being written) keeps each vessel's buffer row numbers, so
+reading the newest data costs the vessel's rows, not the whole buffer.
+Appends, seals and the copy of those rows hold one lock, so read() can run on
+any thread (e.g. FastAPI's threadpool) while the event loop appends.
+"""
+import os
+import shutil
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+SEGMENT_SECONDS = 3600
+COORD_SCALE = 10_000_000  # lat/lon stored as int32 degrees * 1e7
+SOG_NA = 1023  # AIS "not available" encodings
+COG_NA = 3600
+HEADING_NA = 511
+NAV_STATUS_NA = 255
+
+MESSAGE_TYPE_CODES = {
+    "PositionReport": 1,
+    "StandardClassBPositionReport": 2,
+    "ExtendedClassBPositionReport": 3,
+    "StandardSearchAndRescueAircraftReport": 4,
+    "AidsToNavigationReport": 5,
+    "BaseStationReport": 6,
+}
+MESSAGE_TYPE_NAMES = {code: name for name, code in MESSAGE_TYPE_CODES.items()}
+
+# Fixed-width encoded row: time and lat/lon are deltas from the previous row of
+# the same vessel (the first row of each run holds time relative to the segment
+# base and absolute lat/lon).
+ROW_DTYPE = np.dtype([
+    ("mmsi", "<u4"),
+    ("dt", "<i4"),  # milliseconds
+    ("dlat", "<i4"),
+    ("dlon", "<i4"),
+    ("sog", "<u2"),  # knots * 10
+    ("cog", "<u2"),  # degrees * 10
+    ("heading", "<u2"),  # degrees
+    ("nav_status", "u1"),
+    ("msg_type", "u1"),
+])
+
+INDEX_DTYPE = np.dtype([
+    ("mmsi", "<u4"),
+    ("start", "<i8"),
+    ("count", "<i8"),
+    ("t_first", "<i8"),  # epoch milliseconds
+    ("t_last", "<i8"),
+])
+
+# Decoded rows handed back to callers
+POINT_DTYPE = np.dtype([
+    ("mmsi", "<u4"),
+    ("time", "<f8"),  # epoch seconds
+    ("lat", "<f8"),
+    ("lon", "<f8"),
+    ("sog", "<f4"),
+    ("cog", "<f4"),
+    ("heading", "<f4"),
+    ("nav_status", "u1"),
+    ("msg_type", "u1"),
+])
+
+# In-memory buffer for the open segment (absolute values)
+_BUFFER_DTYPE = np.dtype([
+    ("mmsi", "<u4"),
+    ("t", "<i8"),
+    ("lat", "<i4"),
+    ("lon", "<i4"),
+    ("sog", "<u2"),
+    ("cog", "<u2"),
+    ("heading", "<u2"),
+    ("nav_status", "u1"),
+    ("msg_type", "u1"),
+])
+
+
+def _scaled(value, scale, na, upper):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return na
+    if value != value or value < 0 or value >= upper:
+        return na
+    return int(round(value * scale))
+
+
+class Segment:
+    """A sealed, memory-mapped segment."""
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = np.load(os.path.join(path, "rows.npy"), mmap_mode="r")
+        self.index = np.load(os.path.join(path, "index.npy"), mmap_mode="r")
+        self.base_ms = int(np.load(os.path.join(path, "base.npy"))[0])
+        self.t_first = int(self.index["t_first"].min()) if len(self.index) else self.base_ms
+        self.t_last = int(self.index["t_last"].max()) if len(self.index) else self.base_ms
+
+    def run(self, mmsi):
+        """Zero-copy slice of the encoded rows for one vessel (empty if absent)."""
+        i = np.searchsorted(self.index["mmsi"], mmsi)
+        if i >= len(self.index) or self.index["mmsi"][i] != mmsi:
+            return self.rows[0:0], None
+        entry = self.index[i]
+        return self.rows[entry["start"]:entry["start"] + entry["count"]], entry
+
+
+def decode_run(rows, base_ms):
+    """Decode one vessel's delta-encoded run into POINT_DTYPE rows."""
+    out = np.empty(len(rows), dtype=POINT_DTYPE)
+    if not len(rows):
+        return out
+    out["mmsi"] = rows["mmsi"]
+    out["time"] = (np.cumsum(rows["dt"], dtype=np.int64) + base_ms) / 1000.0
+    out["lat"] = np.cumsum(rows["dlat"], dtype=np.int64) / COORD_SCALE
+    out["lon"] = np.cumsum(rows["dlon"], dtype=np.int64) / COORD_SCALE
+    _decode_common(rows, out)
+    return out
+
+
+def _decode_common(rows, out):
+    sog = rows["sog"].astype(np.float32) / 10
+    sog[rows["sog"] == SOG_NA] = np.nan
+    cog = rows["cog"].astype(np.float32) / 10
+    cog[rows["cog"] == COG_NA] = np.nan
+    heading = rows["heading"].astype(np.float32)
+    heading[rows["heading"] == HEADING_NA] = np.nan
+    out["sog"] = sog
+    out["cog"] = cog
+    out["heading"] = heading
+    out["nav_status"] = rows["nav_status"]
+    out["msg_type"] = rows["msg_type"]
+
+
+def encode_segment(buffer, base_ms):
+    """Sort absolute rows by (mmsi, time) and delta-encode each vessel's run."""
+    order = np.lexsort((buffer["t"], buffer["mmsi"]))
+    rows_abs = buffer[order]
+    n = len(rows_abs)
+    rows = np.empty(n, dtype=ROW_DTYPE)
+    mmsi = rows_abs["mmsi"]
+    run_start = np.ones(n, dtype=bool)
+    run_start[1:] = mmsi[1:] != mmsi[:-1]
+    t = rows_abs["t"] - base_ms
+    lat = rows_abs["lat"].astype(np.int64)
+    lon = rows_abs["lon"].astype(np.int64)
+    dt = np.diff(t, prepend=0)
+    dlat = np.diff(lat, prepend=0)
+    dlon = np.diff(lon, prepend=0)
+    dt[run_start] = t[run_start]
+    dlat[run_start] = lat[run_start]
+    dlon[run_start] = lon[run_start]
+    rows["mmsi"] = mmsi
+    rows["dt"] = dt
+    rows["dlat"] = dlat
+    rows["dlon"] = dlon
+    for name in ("sog", "cog", "heading", "nav_status", "msg_type"):
+        rows[name] = rows_abs[name]
+    starts = np.flatnonzero(run_start)
+    ends = np.append(starts[1:], n)
+    index = np.empty(len(starts), dtype=INDEX_DTYPE)
+    index["mmsi"] = mmsi[starts]
+    index["start"] = starts
+    index["count"] = ends - starts
+    index["t_first"] = rows_abs["t"][starts]
+    index["t_last"] = rows_abs["t"][ends - 1]
+    return rows, index
+
+
+class HistoryArchive:
+    def __init__(self, directory, segment_seconds=SEGMENT_SECONDS, buffer_rows=65536):
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-archive")
+        self._segments = []
+        self._sealing = []  # (base_ms, buffer, rows by mmsi) handed to the writer but not yet on disk
+        self._buffer = np.empty(buffer_rows, dtype=_BUFFER_DTYPE)
+        self._size = 0
+        self._rows_by_mmsi = {}  # {mmsi: array of buffer row numbers} for the open segment
+        self._base_ms = None
+        self.stats = {"appended": 0, "sealed_segments": 0, "dropped": 0}
+        self._load_segments()
+
+    def _load_segments(self):
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            if os.path.exists(os.path.join(path, "index.npy")):
+                try:
+                    self._segments.append(Segment(path))
+                except (OSError, ValueError) as e:
+                    print(f"Skipping unreadable archive segment {path}: {e}")
+
+    # --- Writing ---
+    def append(self, mmsi, epoch, lat, lon, sog=None, cog=None, heading=None, nav_status=None, message_type="PositionReport"):
+        try:
+            mmsi = int(mmsi)
+            t_ms = int(epoch * 1000)
+            lat_i = int(round(float(lat) * COORD_SCALE))
+            lon_i = int(round(float(lon) * COORD_SCALE))
+        except (TypeError, ValueError):
+            self.stats["dropped"] += 1
+            return
+        seg_ms = self.segment_seconds * 1000
+        base_ms = t_ms - t_ms % seg_ms
+        if self._base_ms is None:
+            self._base_ms = base_ms
+        elif base_ms > self._base_ms:
+            self.seal()
+            self._base_ms = base_ms
+        elif self._base_ms - t_ms >= 2 ** 31:
+            # Too old to encode relative to the open segment
+            self.stats["dropped"] += 1
+            return
+        row = (
+            mmsi, t_ms, lat_i, lon_i,
+            _scaled(sog, 10, SOG_NA, 102.3),
+            _scaled(cog, 10, COG_NA, 360),
+            _scaled(heading, 1, HEADING_NA, 360),
+            nav_status if isinstance(nav_status, int) and 0 <= nav_status < 16 else NAV_STATUS_NA,
+            MESSAGE_TYPE_CODES.get(message_type, 0),
+        )
+        with self._lock:
+            if self._size == len(self._buffer):
+                self._buffer = np.resize(self._buffer, len(self._buffer) * 2)
+            self._buffer[self._size] = row
+            rows = self._rows_by_mmsi.get(mmsi)
+            if rows is None:
+                rows = self._rows_by_mmsi[mmsi] = array("q")
+            rows.append(self._size)
+            self._size += 1
+        self.stats["appended"] += 1
+
+    def seal(self):
+        """Close the open segment and write it to disk in the background."""
+        with self._lock:
+            if not self._size:
+                return None
+            # The open buffer is reused for the next segment, so the writer gets a copy
+            pending = (self._base_ms, self._buffer[:self._size].copy(), self._rows_by_mmsi)
+            self._rows_by_mmsi = {}
+            self._size = 0
+            self._sealing.append(pending)
+        return self._writer.submit(self._write_segment, pending)
+
+    def _write_segment(self, pending):
+        base_ms, buffer, _ = pending
+        rows, index = encode_segment(buffer, base_ms)
+        name = datetime.fromtimestamp(base_ms / 1000, tz=timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        path = os.path.join(self.directory, name)
+        suffix = 1
+        while os.path.exists(path):
+            path = os.path.join(self.directory, f"{name}-{suffix}")
+            suffix += 1
+        tmp = path + ".tmp"
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, "rows.npy"), rows)
+        np.save(os.path.join(tmp, "index.npy"), index)
+        np.save(os.path.join(tmp, "base.npy"), np.array([base_ms], dtype=np.int64))
+        os.rename(tmp, path)
+        segment = Segment(path)
+        with self._lock:
+            self._segments.append(segment)
+            self._sealing.remove(pending)
+        self.stats["sealed_segments"] += 1
+
+    def close(self):
+        self.seal()
+        self._writer.shutdown(wait=True)
+
+    # --- Reading ---
+    def segments(self):
+        """Sealed segments (memory-mapped), e.g. for offline analytics scans."""
+        with self._lock:
+            return list(self._segments)
+
+    def read(self, mmsi, since=None, until=None):
+        """All archived points for `mmsi` as POINT_DTYPE rows, oldest first."""
+        mmsi = int(mmsi)
+        since_ms = None if since is None else int(since * 1000)
+        until_ms = None if until is None else int(until * 1000)
+        parts = []
+        with self._lock:
+            segments = list(self._segments)
+            pending = list(self._sealing)
+            found = self._rows_by_mmsi.get(mmsi)
+            # Copied now: after the lock is released the open buffer can be appended to, grown or reused
+            open_rows = self._buffer[np.array(found, dtype=np.int64)] if found is not None else None
+        for segment in segments:
+            if since_ms is not None and segment.t_last < since_ms:
+                continue
+            if until_ms is not None and segment.t_first > until_ms:
+                continue
+            rows, entry = segment.run(mmsi)
+            if entry is not None:
+                parts.append(decode_run(rows, segment.base_ms))
+        # Pending buffers are private copies that no longer change
+        selected = [buffer[np.array(by_mmsi[mmsi], dtype=np.int64)] for _, buffer, by_mmsi in pending if mmsi in by_mmsi]
+        if open_rows is not None:
+            selected.append(open_rows)
+        for rows in selected:
+            if len(rows):
+                out = np.empty(len(rows), dtype=POINT_DTYPE)
+                out["mmsi"] = rows["mmsi"]
+                out["time"] = rows["t"] / 1000.0
+                out["lat"] = rows["lat"] / COORD_SCALE
+                out["lon"] = rows["lon"] / COORD_SCALE
+                _decode_common(rows, out)
+                parts.append(out)
+        if not parts:
+            return np.empty(0, dtype=POINT_DTYPE)
+        points = np.concatenate(parts)
+        points = points[np.argsort(points["time"], kind="stable")]
+        if since is not None:
+            points = points[points["time"] >= since]
+        if until is not None:
+            points = points[points["time"] <= until]
+        return points
+
+
+def points_to_dicts(points):
+    """Convert POINT_DTYPE rows to JSON-friendly dicts."""
+    result = []
+    for row in points.tolist():
+        mmsi, t, lat, lon, sog, cog, heading, nav_status, msg_type = row
+        result.append({
+            "mmsi": mmsi,
+            "timestamp": datetime.fromtimestamp(t, tz=timezone.utc).isoformat(),
+            "lat": lat,
+            "lon": lon,
+            "sog": None if sog != sog else round(sog, 1),
+            "cog": None if cog != cog else round(cog, 1),
+            "heading": None if heading != heading else heading,
+            "navigational_status": None if nav_status == NAV_STATUS_NA else nav_status,
+            "message_type": MESSAGE_TYPE_NAMES.get(msg_type),
+        })
+    return result
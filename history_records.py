@@ -0,0 +1,436 @@
+"""
+Compact history point records.
+
+A history point used to be a dict holding the parsed fields, the raw report
+dict and the whole parsed message (raw report and MetaData again), plus a
+merged copy of MetaData with the vessel's static fields. Records keep each
+value once:
+
+- normalized fields in __slots__,
+- the raw report and MetaData as a shared key tuple plus a value tuple
+  (values are the objects already referenced by the normalized fields),
+- the merged static fields as a reference to a shared, never-mutated dict,
+- categorical strings (ship names, call signs, destinations) as references to
+  the one instance kept by their StringTable, instead of a copy per message.
+  Once a table has doubled since it was last rebuilt, the expiry sweeper
+  rebuilds it from the values the live records and static fields still hold.
+
+to_dict() rebuilds the exact JSON shape the frontend and API expect; it is
+only called when a point is broadcast or requested.
+
+    python history_records.py [ais_stream.log] [limit]
+
+compares the memory held per point by records and by the equivalent dicts.
+"""
+import math
+import struct
+import sys
+
+_shapes = {}  # key tuple -> the shared instance of that tuple
+_small_ints = {}  # e.g. MIDs, shared instead of one int object per point
+
+PROFILE_KEYS = ("speed_mean", "speed_std", "heading_mean", "heading_std")
+# time_diff, delta_speed, delta_heading, profile means/stds (NaN = None/absent), profile n
+_DERIVED = struct.Struct("<7dI")
+_MESSAGE_KEYS = ("Message", "MessageType", "MetaData")
+
+
+class StringTable:
+    """Distinct values of one categorical string field; equal values share the table's str instance."""
+
+    __slots__ = ("name", "_values", "_kept")
+
+    def __init__(self, name):
+        self.name = name
+        self._values = {}  # value -> the shared instance
+        self._kept = 0  # values kept by the last rebuild
+
+    def __len__(self):
+        return len(self._values)
+
+    def intern(self, value):
+        """The shared instance equal to `value` (non-strings are returned unchanged)."""
+        if type(value) is not str:
+            return value
+        return self._values.setdefault(value, value)
+
+    def grown(self):
+        """Whether the table has doubled since its last rebuild (so at most half of it can be unused)."""
+        return len(self._values) > max(2 * self._kept, _MIN_REBUILD)
+
+    def rebuild(self, live):
+        """Keep only the values in `live` (the set still referenced); returns the number dropped."""
+        dropped = len(self._values)
+        self._values = {v: v for v in self._values if v in live}
+        self._kept = len(self._values)
+        return dropped - self._kept
+
+    def get_stats(self):
+        return {"values": len(self._values), "kept": self._kept,
+                "bytes": sum(sys.getsizeof(v) for v in self._values)}
+
+
+_MIN_REBUILD = 1000  # tables smaller than this are never worth a scan of the records
+
+SHIP_NAMES = StringTable("ship_names")
+CALLSIGNS = StringTable("callsigns")
+DESTINATIONS = StringTable("destinations")
+SHIP_TYPE_MEANINGS = StringTable("ship_type_meanings")
+STRING_TABLES = {t.name: t for t in (SHIP_NAMES, CALLSIGNS, DESTINATIONS, SHIP_TYPE_MEANINGS)}
+
+
+def string_tables_grown():
+    return any(table.grown() for table in STRING_TABLES.values())
+
+
+def prune_string_tables(records=(), fields=()):
+    """
+    Rebuild every string table from the interned values still held by
+    `records` (including their static fields) and the field dicts `fields`;
+    with neither, empty the tables. Returns the number of values dropped.
+    """
+    live = {table: set() for table in STRING_TABLES.values()}
+    statics = {}  # id -> static field dict; records share a few of them
+    # Consecutive records (one vessel's track) mostly share key tuples, so positions are looked up per run
+    raw_keys = meta_keys = None
+    for record in records:
+        if record.raw_keys is not raw_keys:
+            raw_keys = record.raw_keys
+            raw_positions = _positions(raw_keys)
+        for i, table in raw_positions:
+            live[table].add(record.raw_values[i])
+        if record.meta_keys is not meta_keys:
+            meta_keys = record.meta_keys
+            meta_positions = _positions(meta_keys)
+        for i, table in meta_positions:
+            live[table].add(record.meta_values[i])
+        if record.static:
+            statics[id(record.static)] = record.static
+    for d in (*statics.values(), *fields):
+        for k, v in d.items():
+            if k in INTERNED_KEYS:
+                live[INTERNED_KEYS[k]].add(v)
+    return sum(table.rebuild(live[table]) for table in STRING_TABLES.values())
+
+# Report, MetaData and static field keys whose string values are interned
+INTERNED_KEYS = {
+    "ShipName": SHIP_NAMES, "Name": SHIP_NAMES, "ship_name": SHIP_NAMES,
+    "CallSign": CALLSIGNS, "Callsign": CALLSIGNS, "callsign": CALLSIGNS,
+    "Destination": DESTINATIONS, "destination": DESTINATIONS,
+    "ship_type_meaning": SHIP_TYPE_MEANINGS,
+}
+_interned_positions = {}  # id(shared key tuple) -> ((index, table), ...) of its interned keys
+
+
+def _shape(keys):
+    keys = tuple(keys)
+    shape = _shapes.get(keys)
+    if shape is None:
+        shape = _shapes[keys] = keys
+        _interned_positions[id(shape)] = tuple((i, INTERNED_KEYS[k]) for i, k in enumerate(keys) if k in INTERNED_KEYS)
+    return shape
+
+
+def _positions(keys):
+    """((index, table), ...) of the interned keys in a key tuple (None: none)."""
+    if keys is None:
+        return ()
+    positions = _interned_positions.get(id(keys))
+    return positions if positions is not None else _interned_positions[id(_shape(keys))]
+
+
+def intern_fields(d):
+    """Copy of a parsed field dict with its categorical strings interned."""
+    return {k: INTERNED_KEYS[k].intern(v) if k in INTERNED_KEYS else v for k, v in d.items()}
+
+
+def pack(d, *shared):
+    """
+    Split a dict into (shared key tuple, value tuple).
+
+    Values equal to one of `shared` are replaced by that object, so e.g.
+    MetaData.latitude reuses the float already held by the record.
+    """
+    if not isinstance(d, dict):
+        return None, d
+    keys = _shape(d)
+    values = tuple(d.values())
+    if shared:
+        values = tuple(_reuse(v, shared) for v in values)
+    return keys, _intern_values(keys, values)
+
+
+def _intern_values(keys, values):
+    positions = _interned_positions[id(keys)]
+    if not positions:
+        return values
+    values = list(values)
+    for i, table in positions:
+        values[i] = table.intern(values[i])
+    return tuple(values)
+
+
+def _reuse(value, shared):
+    if type(value) in (int, float):
+        for candidate in shared:
+            if type(candidate) is type(value) and candidate == value:
+                return candidate
+    return value
+
+
+def unpack(keys, values):
+    return dict(zip(keys, values)) if keys is not None else values
+
+
+def _nan(x):
+    return math.nan if x is None else x
+
+
+def _none(x):
+    return None if x != x else x
+
+
+def pack_derived(time_diff, delta_speed, delta_heading, profile):
+    """Pack the per-point derived floats into one bytes object (much smaller than separate floats)."""
+    return _DERIVED.pack(_nan(time_diff), _nan(delta_speed), _nan(delta_heading),
+                         *(_nan(profile.get(k)) for k in PROFILE_KEYS), profile.get("n", 0))
+
+
+def intern_int(value):
+    if type(value) is not int:
+        return value
+    return _small_ints.setdefault(value, value)
+
+
+class HistoryRecord:
+    """Any received message: its raw body and MetaData."""
+
+    __slots__ = ("timestamp", "message_type", "raw_key", "raw_keys", "raw_values",
+                 "meta_keys", "meta_values", "static", "extra")
+
+    # Fields only position records carry
+    alert = None
+    lat = None
+    lon = None
+
+    def __init__(self, msg, msg_type, meta, raw_key, body, timestamp, static=None, shared=()):
+        self.timestamp = timestamp
+        self.message_type = msg_type
+        self.raw_key = raw_key
+        self.raw_keys, self.raw_values = pack(body, meta.get("MMSI"))
+        self.meta_keys, self.meta_values = pack(meta, meta.get("MMSI"), *shared)
+        self.static = static or None
+        extra = tuple((k, v) for k, v in msg.items() if k not in _MESSAGE_KEYS)
+        self.extra = extra or ()
+
+    def intern(self):
+        """
+        Re-share key tuples and categorical strings after unpickling (worker
+        results, checkpoints), which gives every record its own copies.
+        """
+        if self.raw_keys is not None:
+            self.raw_keys = _shape(self.raw_keys)
+            self.raw_values = _intern_values(self.raw_keys, self.raw_values)
+        if self.meta_keys is not None:
+            self.meta_keys = _shape(self.meta_keys)
+            self.meta_values = _intern_values(self.meta_keys, self.meta_values)
+        return self
+
+    def raw(self):
+        return unpack(self.raw_keys, self.raw_values)
+
+    def raw_get(self, key, default=None):
+        if self.raw_keys is None:
+            return default
+        try:
+            return self.raw_values[self.raw_keys.index(key)]
+        except ValueError:
+            return default
+
+    def metadata(self):
+        return unpack(self.meta_keys, self.meta_values)
+
+    def meta(self):
+        """MetaData merged with the static fields known when the point was recorded."""
+        metadata = self.metadata()
+        return {**metadata, **self.static} if self.static else metadata
+
+    @property
+    def ship_name(self):
+        if self.meta_keys is None or "ShipName" not in self.meta_keys:
+            return None
+        return self.meta_values[self.meta_keys.index("ShipName")]
+
+    def _base_dict(self):
+        raw = self.raw()
+        metadata = self.metadata()
+        full_message = {"Message": {self.message_type: raw}, "MessageType": self.message_type, "MetaData": metadata}
+        full_message.update(self.extra)
+        return {
+            "timestamp": self.timestamp,
+            self.raw_key: raw,
+            "meta": {**metadata, **self.static} if self.static else metadata,
+            "message_type": self.message_type,
+            "full_message": full_message,
+        }
+
+    def to_dict(self):
+        return self._base_dict()
+
+
+class ClassBRecord(HistoryRecord):
+    """StandardClassBPositionReport."""
+
+    __slots__ = ("navigational_status", "sog", "heading", "lat", "lon", "flag", "mid")
+
+    def __init__(self, msg, msg_type, meta, raw_key, body, timestamp, static, lat, lon, sog, heading,
+                 navigational_status, flag, mid):
+        super().__init__(msg, msg_type, meta, raw_key, body, timestamp, static, shared=(lat, lon))
+        self.navigational_status = navigational_status
+        self.sog = sog
+        self.heading = heading
+        self.lat = lat
+        self.lon = lon
+        self.flag = flag
+        self.mid = intern_int(mid)
+
+    def to_dict(self):
+        d = self._base_dict()
+        d["navigational_status"] = self.navigational_status
+        d["sog"] = self.sog
+        d["heading"] = self.heading
+        d["lat"] = self.lat
+        d["lon"] = self.lon
+        d["flag"] = self.flag
+        d["mid"] = self.mid
+        return d
+
+
+class PositionRecord(HistoryRecord):
+    """Class A PositionReport with the derived profile, deltas and alert."""
+
+    __slots__ = ("alert", "navigational_status", "rate_of_turn", "sog", "heading", "lat", "lon",
+                 "derived", "flag", "mid")
+
+    def __init__(self, msg, msg_type, meta, raw_key, body, timestamp, static, lat, lon, sog, heading,
+                 navigational_status, rate_of_turn, time_diff, alert, profile, delta_speed, delta_heading, flag, mid):
+        super().__init__(msg, msg_type, meta, raw_key, body, timestamp, static, shared=(lat, lon))
+        self.alert = alert
+        self.navigational_status = navigational_status
+        self.rate_of_turn = rate_of_turn
+        self.sog = sog
+        self.heading = heading
+        self.lat = lat
+        self.lon = lon
+        self.derived = pack_derived(time_diff, delta_speed, delta_heading, profile)
+        self.flag = flag
+        self.mid = intern_int(mid)
+
+    @property
+    def time_diff(self):
+        return _none(_DERIVED.unpack(self.derived)[0])
+
+    @property
+    def delta_speed(self):
+        return _none(_DERIVED.unpack(self.derived)[1])
+
+    @property
+    def delta_heading(self):
+        return _none(_DERIVED.unpack(self.derived)[2])
+
+    @property
+    def normal_profile(self):
+        values = _DERIVED.unpack(self.derived)
+        profile = {k: v for k, v in zip(PROFILE_KEYS, values[3:7]) if v == v}
+        profile["n"] = values[7]
+        return profile
+
+    def to_dict(self):
+        time_diff, delta_speed, delta_heading = (_none(v) for v in _DERIVED.unpack(self.derived)[:3])
+        d = self._base_dict()
+        d["time_diff"] = time_diff
+        d["alert"] = self.alert
+        d["navigational_status"] = self.navigational_status
+        d["rate_of_turn"] = self.rate_of_turn
+        d["sog"] = self.sog
+        d["heading"] = self.heading
+        d["lat"] = self.lat
+        d["lon"] = self.lon
+        d["normal_profile"] = self.normal_profile
+        d["delta_speed"] = delta_speed
+        d["delta_heading"] = delta_heading
+        d["flag"] = self.flag
+        d["mid"] = self.mid
+        return d
+
+
+def deep_size(obj, seen):
+    """Bytes held by `obj` and everything it references that is not already in `seen`."""
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(deep_size(v, seen) for v in obj)
+    else:
+        for cls in type(obj).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                if hasattr(obj, name):
+                    size += deep_size(getattr(obj, name), seen)
+    return size
+
+
+def _legacy_point(record, msg):
+    """The dict the server used to keep for `record`, sharing objects with the parsed message as it did."""
+    d = record.to_dict()
+    raw = msg["Message"][record.message_type]
+    d[record.raw_key] = raw
+    d["full_message"] = msg
+    if isinstance(record, (PositionRecord, ClassBRecord)):
+        d["meta"] = {**msg["MetaData"], **(record.static or {})}
+        d["lat"], d["lon"] = raw["Latitude"], raw["Longitude"]
+        if d["sog"] is not None:
+            d["sog"] = float(raw["Sog"])
+    else:
+        d["meta"] = msg["MetaData"]
+    return d
+
+
+def _benchmark(path, limit):
+    import contextlib
+    import io
+
+    import ais_codec
+    import ais_websocket_server as server
+
+    server.ais_log_sink = None
+    appended = []
+    server.on_history_append = lambda mmsi, record, epoch: appended.append(record)
+    records, legacy = [], []
+    with open(path, "rb") as f, contextlib.redirect_stdout(io.StringIO()):
+        for i, line in enumerate(f):
+            if i >= limit:
+                break
+            server.process_stream_frame(line.strip())
+            for record in appended:
+                records.append(record)
+                legacy.append(_legacy_point(record, ais_codec.loads(line)))
+            appended.clear()
+    # Shared objects (key strings, interned shapes, small ints) count once per collection
+    print(f"{'':<28}{'points':>8}{'record B':>10}{'dict B':>10}")
+    for name in ("PositionRecord", "ClassBRecord", "HistoryRecord", None):
+        pairs = [(r, d) for r, d in zip(records, legacy) if name is None or type(r).__name__ == name]
+        if not pairs:
+            continue
+        rb = deep_size([r for r, _ in pairs], set()) / len(pairs)
+        db = deep_size([d for _, d in pairs], set()) / len(pairs)
+        print(f"{name or 'all':<28}{len(pairs):>8}{rb:>10.0f}{db:>10.0f}   {db / rb:.1f}x smaller")
+    for table in STRING_TABLES.values():
+        stats = table.get_stats()
+        print(f"{table.name:<28}{stats['values']:>8} distinct, {stats['bytes']} B")
+
+
+if __name__ == "__main__":
+    _benchmark(sys.argv[1] if len(sys.argv) > 1 else "ais_stream.log", int(sys.argv[2]) if len(sys.argv) > 2 else 20000)
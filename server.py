@@ -7,6 +7,7 @@ from flask import Flask, request, jsonify, send_from_directory
 import requests
 from concurrent.futures import ThreadPoolExecutor
 import logging
+from ais_regions import load_regions
 
 # Load environment variables
 dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
@@ -34,13 +35,12 @@ connected_clients = set()
 
 async def forward_ais_data():
     """Forward AIS data from AISStream.io to connected websocket clients"""
-    # Bounding box for the San Francisco Bay Area
-    BBOX_SF_BAY = [[38.2, -123.0], [37.2, -121.5]]
     WS_URL = "wss://stream.aisstream.io/v0/stream"
     
+    # All configured regions (SF Bay Area by default) on one connection
     subscription_msg = {
         "APIKey": API_KEY,
-        "BoundingBoxes": [BBOX_SF_BAY]
+        "BoundingBoxes": [bbox for group in load_regions() for _, bbox in group]
     }
     
     while True:
@@ -48,7 +48,7 @@ async def forward_ais_data():
             logger.info("Connecting to AIS stream...")
             async with websockets.connect(WS_URL) as ws:
                 await ws.send(json.dumps(subscription_msg))
-                logger.info("Subscribed to AIS stream for SF Bay Area")
+                logger.info("Subscribed to AIS stream")
                 
                 async for message in ws:
                     data = json.loads(message)
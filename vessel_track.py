@@ -0,0 +1,213 @@
+"""
+Bounded in-memory history for one vessel.
+
+Each track keeps the numeric fields the detectors read in a structured numpy
+array (TRACK_DTYPE) and the history point records in a parallel object
+array. Both grow geometrically up to twice the capacity; once full, the live
+window is shifted back to the front, so appends stay amortized O(1) and the
+live rows are always one contiguous slice:
+
+    track.rows["sog"][-100:]     # zero-copy view of the last 100 speeds
+
+Rows are kept sorted by time (late reports are inserted in place, which is
+cheap because they land near the end), so the time column doubles as the
+vessel's time index: window() finds a time range with two binary searches.
+Rows older than `horizon` seconds (relative to the newest row) or beyond
+`capacity` are evicted from the front, which keeps memory flat however long
+a vessel stays in range. Records are only turned into API dicts on request.
+
+compact() thins rows older than a cutoff with time-aware Douglas-Peucker
+(see ais_simplify.py); each row is compacted once, however often it runs.
+"""
+import math
+
+import numpy as np
+
+from ais_simplify import simplify_track
+
+TRACK_DTYPE = np.dtype([
+    ("time", "<f8"),  # epoch seconds
+    ("lat", "<f8"),  # NaN for reports without a position
+    ("lon", "<f8"),
+    ("sog", "<f8"),  # knots, NaN if not available
+    ("heading", "<f8"),  # TrueHeading in degrees, NaN if not available (511)
+    ("flags", "u1"),
+])
+
+FLAG_POSITION = 0x01  # class A PositionReport
+FLAG_CLASS_B = 0x02  # StandardClassBPositionReport
+FLAG_STATIC = 0x04  # StaticData / ShipStaticData
+FLAG_ALERT = 0x08  # the record carries an alert
+
+INITIAL_ROWS = 16
+_ROW_BYTES = np.dtype((np.void, TRACK_DTYPE.itemsize))
+
+
+def _value(x):
+    return math.nan if x is None else x
+
+
+def time_range(times, since=None, until=None):
+    """(lo, hi) such that times[lo:hi] lies within [since, until]; `times` must be sorted."""
+    lo = 0 if since is None else int(np.searchsorted(times, since, "left"))
+    hi = len(times) if until is None else int(np.searchsorted(times, until, "right"))
+    return lo, max(lo, hi)
+
+
+def parse_cursor(cursor):
+    """(time, rows returned at that time) of a paginate() cursor; raises ValueError when malformed."""
+    t, _, skip = cursor.partition(":")
+    return float(t), int(skip or 0)
+
+
+def paginate(times, since=None, until=None, limit=None, cursor=None):
+    """
+    Page through sorted `times`: returns (lo, hi, next_cursor).
+
+    A cursor is "<time>:<n>", the time of the last row returned and how many
+    rows with exactly that time were returned, so paging stays correct when
+    older rows are evicted between requests. Raises ValueError for a
+    malformed cursor.
+    """
+    lo, hi = time_range(times, since, until)
+    if cursor:
+        t, skip = parse_cursor(cursor)
+        lo = max(lo, int(np.searchsorted(times, t, "left")) + skip)
+        hi = max(lo, hi)
+    if limit is None or hi - lo <= limit:
+        return lo, hi, None
+    hi = lo + limit
+    last = times[hi - 1]
+    returned_at_last = hi - max(lo, int(np.searchsorted(times, last, "left")))
+    if cursor and float(last) == t:
+        returned_at_last += skip
+    return lo, hi, f"{float(last)!r}:{returned_at_last}"
+
+
+class VesselTrack:
+    __slots__ = ("capacity", "horizon", "_rows", "_records", "_start", "_end", "_compacted")
+
+    def __init__(self, capacity=2000, horizon=None):
+        self.capacity = capacity
+        self.horizon = horizon or None  # seconds; None keeps rows until capacity evicts them
+        size = min(INITIAL_ROWS, 2 * capacity)
+        self._rows = np.empty(size, dtype=TRACK_DTYPE)
+        self._records = np.empty(size, dtype=object)
+        self._start = 0
+        self._end = 0
+        self._compacted = -math.inf  # rows before this time have been compacted
+
+    def __len__(self):
+        return self._end - self._start
+
+    @property
+    def rows(self):
+        """Live rows, oldest first (a view; do not keep it across appends)."""
+        return self._rows[self._start:self._end]
+
+    @property
+    def records(self):
+        """Live history point records, oldest first (a view)."""
+        return self._records[self._start:self._end]
+
+    @property
+    def nbytes(self):
+        """Bytes allocated for the rows and record pointers (not the records themselves)."""
+        return self._rows.nbytes + self._records.nbytes
+
+    def window(self, since=None, until=None):
+        """(lo, hi) indexes into rows/records of the rows with since <= time <= until."""
+        return time_range(self._rows["time"][self._start:self._end], since, until)
+
+    def append(self, epoch, lat, lon, sog, heading, flags, record):
+        if self._end == len(self._rows):
+            self._make_room()
+        start, end = self._start, self._end
+        times = self._rows["time"]
+        pos = end
+        if end > start and epoch < times[end - 1]:
+            # Late report: insert it in time order
+            pos = start + int(np.searchsorted(times[start:end], epoch, "right"))
+            self._rows[pos + 1:end + 1] = self._rows[pos:end]
+            self._records[pos + 1:end + 1] = self._records[pos:end]
+        self._rows[pos] = (epoch, _value(lat), _value(lon), _value(sog), _value(heading), flags)
+        self._records[pos] = record
+        self._end = end + 1
+        if self._end - self._start > self.capacity:
+            self._drop(self._end - self._start - self.capacity)
+        if self.horizon is not None:
+            self.expire(times[self._end - 1] - self.horizon)
+
+    def expire(self, cutoff):
+        """Drop rows older than `cutoff` (epoch seconds) from the front; returns how many."""
+        n = int(np.searchsorted(self._rows["time"][self._start:self._end], cutoff, "left"))
+        if n:
+            self._drop(n)
+        return n
+
+    def load(self, rows, records):
+        """
+        Replace the contents with sorted `rows`; `records` belong to the newest
+        rows, older rows are kept as detector-only rows (record None).
+        """
+        n = min(len(rows), self.capacity)
+        k = min(len(records), n)
+        size = min(max(INITIAL_ROWS, n), 2 * self.capacity)
+        self._rows = np.empty(size, dtype=TRACK_DTYPE)
+        self._records = np.empty(size, dtype=object)
+        # Copying as opaque bytes skips numpy's per-field copy of the packed dtype
+        self._rows.view(_ROW_BYTES)[:n] = rows[len(rows) - n:].view(_ROW_BYTES)
+        if k:
+            self._records[n - k:n] = records[len(records) - k:]
+        self._start, self._end = 0, n
+        self._compacted = -math.inf
+
+    def compact(self, before, tolerance):
+        """
+        Simplify the rows older than `before` (epoch seconds) that were not
+        compacted yet to within `tolerance` meters, keeping rows without a
+        position and alert rows; returns how many rows were dropped.
+        """
+        start, end = self._start, self._end
+        times = self._rows["time"][start:end]
+        lo = start + int(np.searchsorted(times, self._compacted, "left"))
+        hi = start + int(np.searchsorted(times, before, "left"))
+        self._compacted = max(self._compacted, before)
+        if hi - lo < 3:
+            return 0
+        rows = self._rows[lo:hi]
+        kept = simplify_track(rows["lat"], rows["lon"], tolerance, rows["time"], (rows["flags"] & FLAG_ALERT) != 0)
+        dropped = (hi - lo) - len(kept)
+        if not dropped:
+            return 0
+        mid = lo + len(kept)
+        self._rows[lo:mid] = rows[kept]
+        self._records[lo:mid] = self._records[lo:hi][kept]
+        self._rows[mid:end - dropped] = self._rows[hi:end]
+        self._records[mid:end - dropped] = self._records[hi:end]
+        self._records[end - dropped:end] = None  # release dropped records
+        self._end = end - dropped
+        return dropped
+
+    def to_dicts(self):
+        return [record.to_dict() for record in self.records if record is not None]
+
+    def _drop(self, n):
+        self._records[self._start:self._start + n] = None  # release evicted records
+        self._start += n
+
+    def _make_room(self):
+        count = len(self)
+        size = len(self._rows)
+        if count > size // 2 and size < 2 * self.capacity:
+            new_size = min(2 * size, 2 * self.capacity)
+            rows = np.empty(new_size, dtype=TRACK_DTYPE)
+            records = np.empty(new_size, dtype=object)
+            rows[:count] = self._rows[self._start:self._end]
+            records[:count] = self._records[self._start:self._end]
+            self._rows, self._records = rows, records
+        else:
+            self._rows[:count] = self._rows[self._start:self._end]
+            self._records[:count] = self._records[self._start:self._end]
+            self._records[count:] = None
+        self._start, self._end = 0, count